@@ -3,26 +3,138 @@ This handles the API endpoints and returns responses for appropriate
 endpoints.
 """
 
+import hashlib
 import os
-import requests
-from flask import Flask, request, abort, jsonify, redirect, render_template
-from flask import session, url_for, make_response
-from flask_session.__init__ import Session
+import re
+from datetime import date, timedelta
+from functools import wraps
+from flask import Flask, request, abort, redirect, render_template
+from flask import session, url_for, make_response, g
+from flask import Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 from six.moves.urllib.parse import urlencode
 
 from auth import build_login_link, requires_auth, AuthError
-from models import setup_db, Product, User, Items_for_Sale
+from auth import get_current_payload, token_cache
+from bulk import BulkImportError, parse_date, parse_products
+from catalog import CATALOG_FIELDS, CATALOG_MAX_AGE, cached_page
+from catalog import catalog_cache, invalidate_catalog
+from compression import init_compression
+from export import EXPORT_BATCH_SIZE, EXPORT_FORMATS, stream_export
+from identity import fetch_userinfo, get_or_create_user, resolve_user_id
+from identity import identity_cache
+from metrics import init_metrics, timed
+from models import db, setup_db, read_query, Product, User, Items_for_Sale
+from models import note_write, use_replica
+from models import wrote_recently, begin_unit_of_work, end_unit_of_work
+from models import on_commit, project_rows
+from pagination import MAX_PAGE_SIZE, seek_page
+from search import search_items
+from response_cache import response_cache
+from serializers import dumps, init_serializer, json_response
+from sessions import init_sessions
 
 ITEMS_PER_PAGE = 10
 
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+def read_only(f):
+    # Mark a handler whose queries may be served by a read replica
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        return f(*args, **kwargs)
+
+    return wrapper
+
+
+'''
+Filters accepted by the bulk update/delete endpoints. Each one turns a value
+from the request body into a SQL criterion, or None when the value is
+invalid.
+'''
+
+
+def text_criterion(column):
+    def build(value):
+        if not isinstance(value, str):
+            return None
+        return column == value
+
+    return build
+
+
+def integer_criterion(column):
+    def build(value):
+        if not isinstance(value, int) or isinstance(value, bool):
+            return None
+        return column == value
+
+    return build
+
+
+def date_criterion(column, before):
+    def build(value):
+        value = parse_date(value)
+        if value is None:
+            return None
+        return column < value if before else column > value
+
+    return build
+
+
+PRODUCT_FILTERS = {
+    'name': text_criterion(Product.name),
+    'expires_before': date_criterion(Product.warranty_end_date, True),
+    'expires_after': date_criterion(Product.warranty_end_date, False),
+    'purchased_before': date_criterion(Product.date_purchased, True),
+    'purchased_after': date_criterion(Product.date_purchased, False)
+}
+
+LISTING_FILTERS = ('expires_before', 'expires_after')
+
+MAX_EXPIRING_WITHIN_DAYS = 3650
+
+
+def parse_period(value):
+    # '30d', '4w' or a plain number of days
+    match = re.match(r'^(\d+)([dw]?)$', value.strip().lower())
+    if match is None:
+        return None
+
+    days = int(match.group(1))
+    if match.group(2) == 'w':
+        days *= 7
+
+    if days > MAX_EXPIRING_WITHIN_DAYS:
+        return None
+
+    return days
+
+
+ITEM_FILTERS = {
+    'name': text_criterion(Items_for_Sale.name),
+    'warranty_period': integer_criterion(Items_for_Sale.warranty_period)
+}
+
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
     setup_db(app)
+    session_store = init_sessions(app)
+    init_metrics(app, db, caches={
+        'token': token_cache,
+        'identity': identity_cache,
+        'response': response_cache,
+        'catalog': catalog_cache,
+        'session': session_store
+    })
+    init_serializer(app)
+    init_compression(app)
     bcrypt = Bcrypt(app)
 
     app.secret_key = 'warranty-api'
@@ -38,13 +150,44 @@ def create_app(test_config=None):
         response.headers.add('Access-Control-Allow-Origin', '*')
         response.headers.add(
             'Access-Control-Allow-Headers',
-            'Content-Type, Authorization, true')
+            'Content-Type, Authorization, Prefer, true')
         response.headers.add(
             'Access-Control-Allow-Methods',
             'GET, POST, PATCH, DELETE, OPTIONS')
 
+        # Keep the user's next reads on the primary until replicas catch up
+        if request.method in WRITE_METHODS and response.status_code < 400 \
+                and 'user_id' in g:
+            note_write(g.user_id)
+
         return response
 
+    '''
+    One transaction per request: handlers stage changes through the model
+    helpers and they are committed together once the response is ready.
+    Error responses and unhandled exceptions roll everything back.
+    '''
+    @app.before_request
+    def begin_transaction():
+        begin_unit_of_work()
+
+    @app.after_request
+    def commit_transaction(response):
+        # Successful writes move the user's data version, and with it the
+        # ETags of their listings
+        if request.method in WRITE_METHODS and response.status_code < 400 \
+                and 'user_id' in g:
+            User.bump_data_version(g.user_id)
+
+        end_unit_of_work(commit=response.status_code < 400)
+
+        return response
+
+    @app.teardown_request
+    def rollback_transaction(exception=None):
+        # No-op when the request already committed or rolled back
+        end_unit_of_work(commit=False)
+
     '''
     GET request to show homepage and allow user to proceed
     '''
@@ -64,7 +207,7 @@ def create_app(test_config=None):
 
         store_user_session(user_token)
 
-        return jsonify(user_token)
+        return json_response(user_token)
 
     @app.route('/login-results', methods=['GET'])
     def login_results():
@@ -78,51 +221,119 @@ def create_app(test_config=None):
         else:
             token = 'Bearer ' + user_token
 
-        response = requests.get('https://dev-jyqum17r.auth0.com/userinfo',
-                                headers={'Authorization': token})
-        userinfo = response.json()
+        userinfo = fetch_userinfo(token)
 
-        session['token'] = token
-        session['jwt_payload'] = userinfo
+        # Only what the pages need; the token and the full profile stay
+        # out of the session
         session['email'] = userinfo['email']
         session['name'] = userinfo['name']
 
-        # Check if user exists
-        user_email = session.get('email')
-        user_name = session.get('name')
-        user = User.query.filter(User.email == user_email).one_or_none()
-
-        if user is None:
-            # User does not exist
-            user = User(name=user_name, email=user_email)
-            # Insert into database
-            user.insert()
+        # Check if user exists and if not, create the user
+        get_or_create_user(userinfo)
 
-    def paginate_products(request, products):
-        page = request.args.get('page', 1, type=int)
+    def page_number(request):
+        # ?page=<n> counts from 1; anything else is a page that does not
+        # exist rather than a silent fallback to the first page
+        try:
+            page = int(request.args.get('page', 1))
+        except ValueError:
+            abort(404)
 
-        if page > len(products):
+        if page < 1:
             abort(404)
 
+        return page
+
+    def paginate_query(request, query, *order_by, fields=None):
+        # Let the database do the paging with a deterministic order
+        page = page_number(request)
         start = (page - 1) * ITEMS_PER_PAGE
-        end = start + ITEMS_PER_PAGE
+        rows = query.order_by(*order_by).limit(
+            ITEMS_PER_PAGE).offset(start).all()
 
-        paginated_products = products[start:end]
+        # Only the first page is allowed to be empty
+        if page > 1 and len(rows) == 0:
+            abort(404)
 
-        return paginated_products
+        return project_rows(rows, fields)
 
-    def paginate_items(request, items):
-        page = request.args.get('page', 1, type=int)
+    def paginate_products(request, user_id):
+        query = read_query(Product).filter(Product.user_id == user_id)
 
-        if page > len(items):
-            abort(404)
+        return paginate_query(request, query, Product.id)
 
-        start = (page - 1) * ITEMS_PER_PAGE
-        end = start + ITEMS_PER_PAGE
+    def paginate_items(request, user_id):
+        query = read_query(Items_for_Sale).filter(
+            Items_for_Sale.user_id == user_id)
+
+        return paginate_query(request, query, Items_for_Sale.id)
 
-        paginated_items = items[start:end]
+    def cursor_requested(request):
+        return 'after' in request.args or 'limit' in request.args
 
-        return paginated_items
+    def paginate_cursor(request, query, *columns, fields=None):
+        # Keyset pagination: ?after=<cursor>&limit=<n>
+        limit = request.args.get('limit', ITEMS_PER_PAGE, type=int)
+        if limit < 1:
+            abort(400)
+
+        try:
+            rows, next_cursor = seek_page(query, columns,
+                                          request.args.get('after'),
+                                          min(limit, MAX_PAGE_SIZE))
+        except ValueError:
+            abort(400)
+
+        return project_rows(rows, fields), next_cursor
+
+    def select_fields(request, model, *sort_keys):
+        # ?fields=id,name narrows the SELECT to the requested columns;
+        # returns (columns to select, fields to return)
+        fields = request.args.get('fields')
+        if fields is None:
+            return None, None
+
+        fields = [field.strip() for field in fields.split(',')
+                  if field.strip()]
+        if not fields or not set(fields).issubset(model.FIELDS):
+            abort(400)
+
+        # Sort keys are selected too so cursors can be built from the rows
+        columns = list(fields)
+        for key in ('id',) + sort_keys:
+            if key in model.FIELDS and key not in columns:
+                columns.append(key)
+
+        return columns, fields
+
+    def product_query(request, user_id, columns=None):
+        # The user's products narrowed by ?expires_before=&expires_after=
+        query = read_query(Product, columns).filter(
+            Product.user_id == user_id)
+
+        for key in LISTING_FILTERS:
+            if key in request.args:
+                criterion = PRODUCT_FILTERS[key](request.args[key])
+                if criterion is None:
+                    abort(400)
+                query = query.filter(criterion)
+
+        return query
+
+    def paginate_products_after(request, query, fields=None):
+        sort = request.args.get('sort', 'id')
+
+        if sort == 'id':
+            return paginate_cursor(request, query, Product.id, fields=fields)
+
+        if sort == 'warranty_end_date':
+            # Products without an end date cannot be ordered by it
+            query = query.filter(Product.warranty_end_date.isnot(None))
+            return paginate_cursor(request, query,
+                                   Product.warranty_end_date, Product.id,
+                                   fields=fields)
+
+        abort(400)
 
     @app.route('/logout')
     def logout():
@@ -132,40 +343,191 @@ def create_app(test_config=None):
         # Redirect user to logout endpoint
         return render_template("home.html")
 
-    # Check if user exists and if not, create the user
+    def preferred_return(request):
+        # ?return=minimal|representation or the Prefer: return=... header
+        value = request.args.get('return')
 
-    def get_user(request):
-        # print(session.get('profile'))
-        user_email = session.get('email')
-        token = session.get('token')
-        if user_email is None or token != request.headers['Authorization']:
-            [session.pop(key) for key in list(session.keys())]
-            store_user_session(request.headers['Authorization'])
-            user_email = session.get('email')
+        if value is None:
+            for preference in request.headers.get('Prefer', '').split(','):
+                name, _, token = preference.partition('=')
+                if name.strip().lower() == 'return':
+                    value = token.strip().strip('"')
 
-        user = User.query.filter(User.email == user_email).one_or_none()
+        if value in ('minimal', 'representation'):
+            return value
 
-        if user is None:
-            abort(404)
+        return None
+
+    def mutation_response(request, resource):
+        # Short response for clients that opted out of the full listing,
+        # None when the legacy listing should be returned
+        preference = preferred_return(request)
+
+        if preference == 'minimal':
+            response = make_response('', 204)
+        elif preference == 'representation':
+            body = {'success': True}
+            body.update(resource)
+            response = json_response(body)
+        else:
+            return None
+
+        response.headers['Preference-Applied'] = 'return=' + preference
+
+        return response
+
+    def selection_criteria(body, model, filters):
+        # Rows to act on: {"ids": [...]} or {"filter": {...}}
+        if not isinstance(body, dict):
+            abort(422)
 
-        return user
+        ids = body.get('ids')
+        if ids is not None:
+            if not isinstance(ids, list) or not ids or \
+                    not all(isinstance(id, int) for id in ids):
+                abort(422)
+            return [model.id.in_(ids)]
+
+        selection = body.get('filter')
+        if not isinstance(selection, dict) or not selection:
+            abort(422)
+
+        criteria = []
+        for key, value in selection.items():
+            if key not in filters:
+                abort(422)
+
+            criterion = filters[key](value)
+            if criterion is None:
+                abort(422)
+            criteria.append(criterion)
+
+        return criteria
+
+    def product_changes(changes):
+        # Column values for a bulk product update
+        if not isinstance(changes, dict) or not changes:
+            abort(422)
+
+        values = {}
+        for field, value in changes.items():
+            if field == 'name':
+                if not isinstance(value, str) or not value.strip():
+                    abort(422)
+                values['name'] = value.strip()
+            elif field in ('date_purchased', 'warranty_end_date'):
+                values[field] = parse_date(value)
+                if values[field] is None:
+                    abort(422)
+            else:
+                abort(422)
+
+        return values
+
+    def export_response(request, query, columns, name):
+        # Stream every row from a server-side cursor as CSV or NDJSON
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            abort(400)
+
+        fields = [column.key for column in columns]
+        rows = query.with_entities(*columns).order_by(
+            columns[0]).yield_per(EXPORT_BATCH_SIZE)
+
+        response = Response(
+            stream_with_context(stream_export(export_format, fields, rows)),
+            mimetype=EXPORT_FORMATS[export_format])
+        response.headers['Content-Disposition'] = \
+            'attachment; filename=%s.%s' % (name, export_format)
+
+        return response
+
+    # Resolve the token's subject to a local user, creating it on first use
+
+    def get_user_id(request):
+        if 'user_id' in g:
+            return g.user_id
+
+        payload = get_current_payload()
+        g.user_id = resolve_user_id(payload, request.headers['Authorization'])
+
+        # The lookup above ran on the primary; the handler's queries may
+        # use a replica unless this user changed data a moment ago
+        if g.get('read_only') and not wrote_recently(g.user_id):
+            use_replica()
+
+        return g.user_id
+
+    def conditional(daily=False):
+        # Strong ETag from the user's data version and the request URL, plus
+        # today's date for listings that depend on it. An unchanged listing
+        # is answered with 304 after one primary key lookup, before the
+        # handler loads any rows. Other clients of the same user get the
+        # encoded body from the response cache.
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                user_id = get_user_id(request)
+                version = User.data_version_of(user_id)
+                key = '%s:%s:%s' % (user_id, version, request.full_path)
+                if daily:
+                    key += ':' + date.today().isoformat()
+                etag = hashlib.sha1(key.encode()).hexdigest()
+
+                if request.if_none_match.contains_weak(etag):
+                    response = make_response('', 304)
+                else:
+                    body = response_cache.get(etag)
+                    if body is not None:
+                        response = app.response_class(
+                            body, mimetype='application/json')
+                        response.headers['X-Cache'] = 'HIT'
+                    else:
+                        response = make_response(f(*args, **kwargs))
+                        if response.status_code != 200:
+                            return response
+                        response_cache.set(etag, response.get_data())
+                        response.headers['X-Cache'] = 'MISS'
+
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'private, no-cache'
+
+                return response
+
+            return wrapper
+
+        return decorator
 
     @app.route('/products', methods=['GET'])
     @requires_auth('get:products')
+    @read_only
+    @conditional()
     def retrieve_products():
         # Get user info
-        user = get_user(request)
-        user_id = user.id
+        user_id = get_user_id(request)
+        columns, fields = select_fields(request, Product,
+                                        request.args.get('sort'))
+        query = product_query(request, user_id, columns)
+
+        if cursor_requested(request):
+            products, next_cursor = paginate_products_after(request, query,
+                                                            fields)
+
+            return json_response({
+                'success': True,
+                'products': products,
+                'total_products': len(products),
+                'next_cursor': next_cursor
+            })
 
         try:
-            products = Product.query.filter(Product.user_id == user_id).all()
-            formatted_products = [product.format() for product in products]
-            paginated_products = paginate_products(request, formatted_products)
+            paginated_products = paginate_query(request, query, Product.id,
+                                                fields=fields)
 
             if len(paginated_products) == 0:
                 paginated_products = []
 
-            return jsonify({
+            return json_response({
                 'success': True,
                 'products': paginated_products,
                 'total_products': len(paginated_products)
@@ -174,13 +536,70 @@ def create_app(test_config=None):
         except BaseException:
             abort(404)
 
+    @app.route('/products/export', methods=['GET'])
+    @requires_auth('get:products')
+    @read_only
+    def export_products():
+        # Download all of the user's products
+        user_id = get_user_id(request)
+
+        query = Product.query.filter(Product.user_id == user_id)
+
+        return export_response(request, query, [
+            Product.id,
+            Product.name,
+            Product.date_purchased,
+            Product.warranty_end_date
+        ], 'products')
+
+    @app.route('/products/expiring', methods=['GET'])
+    @requires_auth('get:products')
+    @read_only
+    @conditional(daily=True)
+    def retrieve_expiring_products():
+        # Products whose warranty ends within ?within= (default 30 days),
+        # soonest first
+        user_id = get_user_id(request)
+
+        days = parse_period(request.args.get('within', '30d'))
+        if days is None:
+            abort(400)
+
+        today = date.today()
+        columns, fields = select_fields(request, Product, 'warranty_end_date')
+        query = read_query(Product, columns).filter(
+            Product.user_id == user_id,
+            Product.warranty_end_date >= today,
+            Product.warranty_end_date <= today + timedelta(days=days))
+
+        if cursor_requested(request):
+            products, next_cursor = paginate_cursor(
+                request, query, Product.warranty_end_date, Product.id,
+                fields=fields)
+
+            return json_response({
+                'success': True,
+                'products': products,
+                'total_products': len(products),
+                'next_cursor': next_cursor
+            })
+
+        products = paginate_query(
+            request, query, Product.warranty_end_date, Product.id,
+            fields=fields)
+
+        return json_response({
+            'success': True,
+            'products': products,
+            'total_products': len(products)
+        })
+
     @app.route('/products', methods=['POST'])
     @requires_auth('post:products')
     def create_product():
         # Create a new product
         # First retrieve the user in session
-        user = get_user(request)
-        user_id = user.id
+        user_id = get_user_id(request)
 
         body = request.get_json()
         if body is None:
@@ -203,14 +622,17 @@ def create_app(test_config=None):
             # Insert product into database
             product.insert()
 
-            products = Product.query.filter(Product.user_id == user_id).all()
-            formatted_products = [product.format() for product in products]
-            paginated_products = paginate_products(request, formatted_products)
+            response = mutation_response(request, {
+                'product': product.format()})
+            if response is not None:
+                return response
+
+            paginated_products = paginate_products(request, user_id)
 
             if len(paginated_products) == 0:
                 abort(404)
 
-            return jsonify({
+            return json_response({
                 'success': True,
                 'products': paginated_products,
                 'total_products': len(paginated_products)
@@ -219,12 +641,92 @@ def create_app(test_config=None):
         except BaseException:
             abort(422)
 
+    @app.route('/products/bulk', methods=['POST'])
+    @requires_auth('post:products')
+    def create_products_bulk():
+        # Import many products at once from a JSON array, NDJSON or CSV
+        user_id = get_user_id(request)
+
+        try:
+            products, errors = parse_products(request, user_id)
+        except BulkImportError as error:
+            return json_response({
+                'success': False,
+                'error': error.status_code,
+                'message': error.message
+            }), error.status_code
+
+        if errors:
+            # Nothing is inserted unless every row is valid
+            return json_response({
+                'success': False,
+                'error': 422,
+                'message': 'cannot process request',
+                'errors': errors
+            }), 422
+
+        if not products:
+            abort(422)
+
+        try:
+            inserted = Product.bulk_insert(products)
+
+        except BaseException:
+            abort(422)
+
+        return json_response({
+            'success': True,
+            'total_products': inserted
+        })
+
+    @app.route('/products', methods=['PATCH'])
+    @requires_auth('patch:products')
+    def update_products_bulk():
+        # Update every product of the user selected by ids or a filter
+        user_id = get_user_id(request)
+
+        body = request.get_json()
+        criteria = selection_criteria(body, Product, PRODUCT_FILTERS)
+        values = product_changes(body.get('set'))
+
+        try:
+            updated = Product.update_where(
+                [Product.user_id == user_id] + criteria, values)
+
+        except BaseException:
+            abort(422)
+
+        return json_response({
+            'success': True,
+            'updated_products': updated
+        })
+
+    @app.route('/products', methods=['DELETE'])
+    @requires_auth('delete:products')
+    def delete_products_bulk():
+        # Delete every product of the user selected by ids or a filter
+        user_id = get_user_id(request)
+
+        body = request.get_json()
+        criteria = selection_criteria(body, Product, PRODUCT_FILTERS)
+
+        try:
+            deleted = Product.delete_where(
+                [Product.user_id == user_id] + criteria)
+
+        except BaseException:
+            abort(422)
+
+        return json_response({
+            'success': True,
+            'deleted_products': deleted
+        })
+
     @app.route('/products/<int:product_id>', methods=['PATCH'])
     @requires_auth('patch:products')
     def update_product(product_id):
         # Retrieve user in session
-        user = get_user(request)
-        user_id = user.id
+        user_id = get_user_id(request)
 
         body = request.get_json()
 
@@ -264,13 +766,14 @@ def create_app(test_config=None):
 
             product.update()
 
-            products = Product.query.order_by(
-                Product.id).filter(
-                Product.user_id == user_id).all()
-            formatted_products = [product.format() for product in products]
-            paginated_products = paginate_products(request, formatted_products)
+            response = mutation_response(request, {
+                'product': product.format()})
+            if response is not None:
+                return response
+
+            paginated_products = paginate_products(request, user_id)
 
-            return jsonify({
+            return json_response({
                 'success': True,
                 'products': paginated_products,
                 'total_products': len(paginated_products)
@@ -283,9 +786,7 @@ def create_app(test_config=None):
     @requires_auth('delete:products')
     def delete_product(product_id):
         # Retrieve user
-        session.clear()
-        user = get_user(request)
-        user_id = user.id
+        user_id = get_user_id(request)
 
         try:
             product = Product.query.filter(
@@ -297,11 +798,13 @@ def create_app(test_config=None):
 
             product.delete()
 
-            products = Product.query.filter(Product.user_id == user_id).all()
-            formatted_products = [product.format() for product in products]
-            paginated_products = paginate_products(request, formatted_products)
+            response = mutation_response(request, {'deleted': product_id})
+            if response is not None:
+                return response
 
-            return jsonify({
+            paginated_products = paginate_products(request, user_id)
+
+            return json_response({
                 'success': True,
                 'products': paginated_products,
                 'total_products': len(paginated_products)
@@ -316,8 +819,7 @@ def create_app(test_config=None):
     @requires_auth('post:item')
     def create_item():
         # Retrieve user
-        user = get_user(request)
-        user_id = user.id
+        user_id = get_user_id(request)
 
         body = request.get_json()
         if body is None:
@@ -338,13 +840,15 @@ def create_app(test_config=None):
                 user_id=user_id)
 
             item.insert()
+            on_commit(invalidate_catalog)
+
+            response = mutation_response(request, {'item': item.format()})
+            if response is not None:
+                return response
 
-            items = Items_for_Sale.query.filter(
-                Items_for_Sale.user_id == user_id).all()
-            formatted_items = [item.format() for item in items]
-            paginated_items = paginate_items(request, formatted_items)
+            paginated_items = paginate_items(request, user_id)
 
-            return jsonify({
+            return json_response({
                 'success': True,
                 'items': paginated_items,
                 'total_items': len(paginated_items)
@@ -355,24 +859,38 @@ def create_app(test_config=None):
 
     @app.route('/items', methods=['GET'])
     @requires_auth('get:items')
+    @read_only
+    @conditional()
     def retrieve_items():
         # Retrieve user
-        user = get_user(request)
-        user_id = user.id
+        user_id = get_user_id(request)
 
         # Retrieve items being sold by seller
-        try:
-            items = Items_for_Sale.query.order_by(
-                Items_for_Sale.id).filter(
-                Items_for_Sale.user_id == user_id).all()
+        columns, fields = select_fields(request, Items_for_Sale)
+        query = read_query(Items_for_Sale, columns).filter(
+            Items_for_Sale.user_id == user_id)
+
+        if cursor_requested(request):
+            items, next_cursor = paginate_cursor(request, query,
+                                                 Items_for_Sale.id,
+                                                 fields=fields)
+
+            return json_response({
+                'success': True,
+                'items': items,
+                'total_items': len(items),
+                'next_cursor': next_cursor
+            })
 
-            formatted_items = [item.format() for item in items]
-            paginated_items = paginate_items(request, formatted_items)
+        try:
+            paginated_items = paginate_query(request, query,
+                                             Items_for_Sale.id,
+                                             fields=fields)
 
             if len(paginated_items) == 0:
                 paginated_items = []
 
-            return jsonify({
+            return json_response({
                 'success': True,
                 'items': paginated_items,
                 'total_items': len(paginated_items)
@@ -381,12 +899,78 @@ def create_app(test_config=None):
         except BaseException:
             abort(404)
 
+    @app.route('/items/search', methods=['GET'])
+    @requires_auth('get:items')
+    @read_only
+    @conditional()
+    def search_seller_items():
+        # Ranked search over the seller's item names and descriptions
+        user_id = get_user_id(request)
+
+        q = request.args.get('q', '').strip()
+        if not q:
+            abort(400)
+
+        page = page_number(request)
+
+        items = search_items(user_id, q, ITEMS_PER_PAGE,
+                             (page - 1) * ITEMS_PER_PAGE)
+
+        # Only the first page is allowed to be empty
+        if page > 1 and len(items) == 0:
+            abort(404)
+
+        return json_response({
+            'success': True,
+            'items': items,
+            'total_items': len(items)
+        })
+
+    @app.route('/items', methods=['DELETE'])
+    @requires_auth('delete:item')
+    def delete_items_bulk():
+        # Delete every item of the seller selected by ids or a filter
+        user_id = get_user_id(request)
+
+        body = request.get_json()
+        criteria = selection_criteria(body, Items_for_Sale, ITEM_FILTERS)
+
+        try:
+            deleted = Items_for_Sale.delete_where(
+                [Items_for_Sale.user_id == user_id] + criteria)
+            if deleted:
+                on_commit(invalidate_catalog)
+
+        except BaseException:
+            abort(422)
+
+        return json_response({
+            'success': True,
+            'deleted_items': deleted
+        })
+
+    @app.route('/items/export', methods=['GET'])
+    @requires_auth('get:items')
+    @read_only
+    def export_items():
+        # Download all of the seller's items
+        user_id = get_user_id(request)
+
+        query = Items_for_Sale.query.filter(Items_for_Sale.user_id == user_id)
+
+        return export_response(request, query, [
+            Items_for_Sale.id,
+            Items_for_Sale.name,
+            Items_for_Sale.warranty_period,
+            Items_for_Sale.item_description,
+            Items_for_Sale.image_link
+        ], 'items')
+
     @app.route('/items/<int:item_id>', methods=['DELETE'])
     @requires_auth('delete:item')
     def delete_item(item_id):
         # Retrieve user
-        user = get_user(request)
-        user_id = user.id
+        user_id = get_user_id(request)
 
         try:
             item = Items_for_Sale.query.filter(
@@ -397,14 +981,15 @@ def create_app(test_config=None):
                 abort(404)
 
             item.delete()
+            on_commit(invalidate_catalog)
 
-            items = Items_for_Sale.query.order_by(
-                Items_for_Sale.id).filter(
-                Items_for_Sale.user_id == user_id).all()
-            formatted_items = [item.format() for item in items]
-            paginated_items = paginate_items(request, formatted_items)
+            response = mutation_response(request, {'deleted': item_id})
+            if response is not None:
+                return response
 
-            return jsonify({
+            paginated_items = paginate_items(request, user_id)
+
+            return json_response({
                 'success': True,
                 'items': paginated_items,
                 'total_items': len(paginated_items)
@@ -413,9 +998,46 @@ def create_app(test_config=None):
         except BaseException:
             abort(404)
 
+    '''
+    GET /catalog: every seller's items, for buyers. It needs no token, so
+    pages are cached whole and marked public for browsers and CDNs.
+    '''
+    @app.route('/catalog', methods=['GET'])
+    def retrieve_catalog():
+        after = request.args.get('after')
+        limit = request.args.get('limit', ITEMS_PER_PAGE, type=int)
+        if limit < 1:
+            abort(400)
+        limit = min(limit, MAX_PAGE_SIZE)
+
+        def build():
+            query = read_query(Items_for_Sale, CATALOG_FIELDS)
+            try:
+                items, next_cursor = seek_page(
+                    query, [Items_for_Sale.id], after, limit)
+            except ValueError:
+                abort(400)
+
+            with timed('serialize'):
+                return dumps({
+                    'success': True,
+                    'items': items,
+                    'total_items': len(items),
+                    'next_cursor': next_cursor
+                })
+
+        body, etag = cached_page((after, limit), build)
+
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = CATALOG_MAX_AGE
+
+        return response.make_conditional(request)
+
     @app.errorhandler(404)
     def not_found(error):
-        return jsonify({
+        return json_response({
             'success': False,
             'error': 404,
             'message': 'request not found'
@@ -423,7 +1045,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(422)
     def unprocessable(error):
-        return jsonify({
+        return json_response({
             'success': False,
             'error': 422,
             'message': 'cannot process request'
@@ -431,7 +1053,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(400)
     def bad_request(error):
-        return jsonify({
+        return json_response({
             'success': False,
             'error': 400,
             'message': 'bad request, try again'
@@ -439,7 +1061,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(500)
     def server_error(error):
-        return jsonify({
+        return json_response({
             'success': False,
             'error': 500,
             'message': 'internal server error'
@@ -447,7 +1069,7 @@ def create_app(test_config=None):
 
     @app.errorhandler(AuthError)
     def authorization_error(error):
-        return jsonify({
+        return json_response({
             'success': False,
             'error': 'AuthError',
             'message': 'Authorization error. Check permissions.'
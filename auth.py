@@ -1,6 +1,9 @@
 import os
 from functools import wraps
+import hashlib
 import json
+import threading
+import time
 from os import environ as env
 from werkzeug.exceptions import HTTPException
 
@@ -8,10 +11,13 @@ from dotenv import load_dotenv, find_dotenv
 from flask import Flask, jsonify, redirect, render_template, url_for, request
 from flask import _request_ctx_stack, abort
 from six.moves.urllib.parse import urlencode
-from jose import jwt
+from jose import jwt, jwk
 from urllib.request import urlopen
 from dotenv import load_dotenv
 
+from cache import LRUCache
+from metrics import timed
+
 load_dotenv()
 
 AUTH0_DOMAIN = os.environ.get('AUTH_DOMAIN')
@@ -19,6 +25,12 @@ ALGORITHMS = os.environ.get('ALGORITHMS')
 API_AUDIENCE = os.environ.get('API_AUDIENCE')
 CLIENT_ID = os.environ.get('CLIENT_ID')
 REDIRECT_URI = os.environ.get('REDIRECT_URI')
+JWKS_URL = os.environ.get('JWKS_URL')
+JWKS_CACHE_TTL = int(os.environ.get('JWKS_CACHE_TTL', 600))
+JWKS_MIN_REFRESH_INTERVAL = int(
+    os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30))
+JWKS_FETCH_TIMEOUT = int(os.environ.get('JWKS_FETCH_TIMEOUT', 5))
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get('TOKEN_CACHE_MAX_SIZE', 1024))
 
 
 def build_login_link():
@@ -45,6 +57,107 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+'''
+JWKSKeyStore
+Keeps the signing keys from the Auth0 JWKS document in memory so
+verify_decode_jwt does not fetch /.well-known/jwks.json on every request.
+The document is refetched once the TTL runs out, or when a token names a kid
+we have not seen (key rotation). Refetches are rate limited so a flood of
+tokens with bogus kids cannot hammer the identity provider, and a failed
+refetch keeps serving the keys we already have.
+'''
+
+
+class JWKSKeyStore:
+    def __init__(self, jwks_url=None, ttl=JWKS_CACHE_TTL,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+                 timeout=JWKS_FETCH_TIMEOUT):
+        self.jwks_url = jwks_url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = None
+        self._lock = threading.Lock()
+
+    def get_url(self):
+        # JWKS_URL may point at a local file (file:///...) or a stub server
+        if self.jwks_url:
+            return self.jwks_url
+        return 'https://%s/.well-known/jwks.json' % (AUTH0_DOMAIN)
+
+    def get_key(self, kid):
+        now = time.monotonic()
+        if self._is_stale(now) or kid not in self._keys:
+            with self._lock:
+                # Another thread may have refreshed while we waited
+                if self._is_stale(now) or kid not in self._keys:
+                    self._refresh(now)
+
+        return self._keys.get(kid)
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._last_attempt = None
+
+    def _is_stale(self, now):
+        return self._fetched_at is None or now - self._fetched_at > self.ttl
+
+    def _refresh(self, now):
+        if (self._last_attempt is not None and
+                now - self._last_attempt < self.min_refresh_interval):
+            return
+
+        self._last_attempt = now
+        try:
+            jwks = self._fetch()
+        except Exception:
+            # Keep serving the keys we have if the IdP is slow or down
+            if not self._keys:
+                raise AuthError({
+                    'code': 'jwks_unavailable',
+                    'description': 'Unable to fetch signing keys.'
+                }, 401)
+            return
+
+        self._keys = self._parse(jwks)
+        self._fetched_at = now
+
+    def _fetch(self):
+        jsonurl = urlopen(self.get_url(), timeout=self.timeout)
+        charset = jsonurl.headers.get_content_charset() or 'utf-8'
+        content = jsonurl.read().decode(charset)
+        return json.loads(content)
+
+    def _parse(self, jwks):
+        # Keep the RSA JWKs by kid; jwt.decode takes the JWK dict, so each
+        # key is only constructed here to drop the ones it cannot load
+        keys = {}
+        for key in jwks.get('keys', []):
+            if key.get('kty') != 'RSA' or 'kid' not in key:
+                continue
+            rsa_key = {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key.get('use'),
+                'n': key['n'],
+                'e': key['e']
+            }
+            try:
+                jwk.construct(rsa_key, key.get('alg', 'RS256'))
+            except Exception:
+                continue
+            keys[key['kid']] = rsa_key
+
+        return keys
+
+
+jwks_store = JWKSKeyStore(jwks_url=JWKS_URL)
+
+
 def get_token_auth_header():
     # Get header from request
     auth_header = request.headers.get('Authorization', None)
@@ -107,22 +220,8 @@ def verify_decode_jwt(token):
             'description': 'No key ID: authorization is malformed'
         }, 401)
 
-    # Verify the token using Auth0 /.well-known/jwks.json
-    domain_url = 'https://%s/.well-known/jwks.json' % (AUTH0_DOMAIN)
-    jsonurl = urlopen(domain_url)
-    content = jsonurl.read().decode(jsonurl.headers.get_content_charset())
-    jwks = json.loads(content)
-    rsa_key = {}
-
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    # Look up the signing key in the cached Auth0 /.well-known/jwks.json
+    rsa_key = jwks_store.get_key(unverified_header['kid'])
 
     if rsa_key:
         try:
@@ -158,13 +257,44 @@ def verify_decode_jwt(token):
     }, 400)
 
 
+'''
+Verified-token cache
+Our clients send the same access token until it expires, so the decoded
+payload is cached under a hash of the token until its 'exp' claim and repeat
+requests skip the RSA signature check. The cache is bounded by
+TOKEN_CACHE_MAX_SIZE entries per worker.
+'''
+
+token_cache = LRUCache(max_size=TOKEN_CACHE_MAX_SIZE)
+
+
+def get_verified_payload(token):
+    token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    payload = token_cache.get(token_hash)
+
+    if payload is None:
+        with timed('jwt_verify'):
+            payload = verify_decode_jwt(token)
+        # Tokens without an expiry are verified every time
+        if 'exp' in payload:
+            token_cache.set(token_hash, payload, expires_at=payload['exp'])
+
+    return payload
+
+
+def get_current_payload():
+    # Claims of the token verified by requires_auth for this request
+    return getattr(_request_ctx_stack.top, 'current_user', None)
+
+
 def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
+            payload = get_verified_payload(token)
             check_permissions(permission, payload)
+            _request_ctx_stack.top.current_user = payload
             return f(*args, **kwargs)
 
         return wrapper
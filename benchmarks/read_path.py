@@ -0,0 +1,84 @@
+"""
+Allocations per listed row on the product listing path, before and after the
+Core read model. "orm" loads Product instances and calls format() the way
+the listing endpoints used to; "core" runs the same page through
+models.read_query. tracemalloc reports the peak memory allocated while one
+page is fetched and formatted, divided by the rows on the page.
+
+Usage: python benchmarks/read_path.py [rows per page ...]
+"""
+
+import os
+import sys
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+from models import setup_db, db, read_query, Product  # noqa: E402
+
+USER_ID = 1
+
+
+def populate(rows):
+    start = date(2020, 1, 1)
+
+    Product.bulk_insert([{
+        'name': 'Product %d' % i,
+        'date_purchased': start + timedelta(days=i),
+        'warranty_end_date': start + timedelta(days=i + 730),
+        'user_id': USER_ID
+    } for i in range(rows)])
+
+
+def orm_page(rows):
+    products = Product.query.filter(Product.user_id == USER_ID).order_by(
+        Product.id).limit(rows).all()
+
+    return [product.format() for product in products]
+
+
+def core_page(rows):
+    return read_query(Product).filter(Product.user_id == USER_ID).order_by(
+        Product.id).limit(rows).all()
+
+
+def measure(fetch, rows):
+    # Warm up statement caches, then trace one fetch. The peak includes
+    # short-lived objects such as ORM instances that format() discards.
+    fetch(rows)
+    db.session.expunge_all()
+
+    tracemalloc.start()
+    page = fetch(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del page
+    db.session.expunge_all()
+
+    return peak / rows
+
+
+def main(sizes):
+    app = Flask(__name__)
+    setup_db(app, 'sqlite://')
+
+    with app.app_context():
+        populate(max(sizes))
+
+        print('%-6s %8s %16s %10s' % ('path', 'rows', 'peak bytes/row',
+                                      'ratio'))
+        for rows in sizes:
+            baseline = None
+            for name, fetch in (('orm', orm_page), ('core', core_page)):
+                peak = measure(fetch, rows)
+                baseline = baseline or peak
+                print('%-6s %8d %16.0f %9.2fx' % (name, rows, peak,
+                                                  baseline / peak))
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [10, 100, 1000])
@@ -0,0 +1,74 @@
+"""
+Throughput of the JSON encoding used for list responses, before and after
+the serializers module. "before" reproduces what Flask 1.0's jsonify did
+(sorted keys, dates as HTTP dates); the others are the registered backends.
+
+Usage: python benchmarks/serialization.py [rows per page ...]
+"""
+
+import json
+import os
+import sys
+import timeit
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.http import http_date  # noqa: E402
+
+from serializers import BACKENDS  # noqa: E402
+
+
+def build_page(rows):
+    start = date(2020, 1, 1)
+
+    return {
+        'success': True,
+        'products': [{
+            'id': i,
+            'name': 'Product %d' % i,
+            'date_purchased': start + timedelta(days=i),
+            'warranty_end_date': start + timedelta(days=i + 730),
+            'user_id': 42
+        } for i in range(rows)],
+        'total_products': rows
+    }
+
+
+def flask_jsonify_default(value):
+    if isinstance(value, date):
+        return http_date(value.timetuple())
+
+    raise TypeError(value)
+
+
+def before(value):
+    return json.dumps(value, default=flask_jsonify_default, sort_keys=True,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def measure(dumps, payload, seconds=1.0):
+    number = 1
+    while True:
+        elapsed = timeit.timeit(lambda: dumps(payload), number=number)
+        if elapsed >= seconds:
+            return number / elapsed
+        number *= 2
+
+
+def main(sizes):
+    encoders = [('before (jsonify)', before)] + sorted(BACKENDS.items())
+
+    print('%-18s %8s %14s %10s' % ('encoder', 'rows', 'pages/s', 'speedup'))
+    for rows in sizes:
+        payload = build_page(rows)
+        baseline = None
+        for name, dumps in encoders:
+            rate = measure(dumps, payload)
+            baseline = baseline or rate
+            print('%-18s %8d %14.0f %9.1fx' % (name, rows, rate,
+                                               rate / baseline))
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [10, 100, 1000])
@@ -0,0 +1,130 @@
+"""
+Parses and validates bulk product uploads (JSON array, NDJSON or CSV).
+"""
+
+import csv
+import json
+import os
+from datetime import date
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BULK_IMPORT_MAX_ROWS = int(os.environ.get('BULK_IMPORT_MAX_ROWS', 100000))
+
+PRODUCT_FIELDS = ('name', 'date_purchased', 'warranty_end_date')
+
+
+class BulkImportError(Exception):
+    def __init__(self, message, status_code=400):
+        self.message = message
+        self.status_code = status_code
+
+
+def iter_lines(stream):
+    # Decode the request body line by line without buffering it whole
+    for line in stream:
+        yield line.decode('utf-8-sig')
+
+
+def read_json(request):
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        body = body.get('products')
+
+    if not isinstance(body, list):
+        raise BulkImportError('expected a JSON array of products')
+
+    return enumerate(body, 1)
+
+
+def read_ndjson(request):
+    for row_number, line in enumerate(iter_lines(request.stream), 1):
+        if not line.strip():
+            continue
+        try:
+            yield row_number, json.loads(line)
+        except ValueError:
+            yield row_number, None
+
+
+def read_csv(request):
+    reader = csv.DictReader(iter_lines(request.stream))
+
+    if reader.fieldnames is None or \
+            not set(PRODUCT_FIELDS).issubset(reader.fieldnames):
+        raise BulkImportError(
+            'CSV header must contain ' + ', '.join(PRODUCT_FIELDS))
+
+    # Row 1 is the header
+    for row_number, row in enumerate(reader, 2):
+        yield row_number, row
+
+
+def read_rows(request):
+    mimetype = request.mimetype
+
+    if mimetype in ('application/x-ndjson', 'application/ndjson'):
+        return read_ndjson(request)
+    if mimetype in ('text/csv', 'application/csv'):
+        return read_csv(request)
+    if mimetype == 'application/json':
+        return read_json(request)
+
+    raise BulkImportError('unsupported content type', 415)
+
+
+def parse_date(value):
+    if isinstance(value, str):
+        try:
+            return date.fromisoformat(value.strip())
+        except ValueError:
+            pass
+
+    return None
+
+
+def validate_product(row):
+    # Returns (values, errors) for one uploaded row
+    if not isinstance(row, dict):
+        return None, {'row': 'must be an object with ' +
+                      ', '.join(PRODUCT_FIELDS)}
+
+    errors = {}
+    name = row.get('name')
+    if not isinstance(name, str) or not name.strip():
+        errors['name'] = 'is required'
+
+    values = {'name': name.strip() if isinstance(name, str) else name}
+    for field in ('date_purchased', 'warranty_end_date'):
+        values[field] = parse_date(row.get(field))
+        if values[field] is None:
+            errors[field] = 'must be a date formatted as YYYY-MM-DD'
+
+    return values, errors
+
+
+def parse_products(request, user_id):
+    # Validate every row before anything is written
+    products = []
+    errors = []
+
+    try:
+        for row_number, row in read_rows(request):
+            if len(products) + len(errors) >= BULK_IMPORT_MAX_ROWS:
+                raise BulkImportError(
+                    'too many rows, the limit is %d' % BULK_IMPORT_MAX_ROWS,
+                    413)
+
+            values, row_errors = validate_product(row)
+            if row_errors:
+                errors.append({'row': row_number, 'errors': row_errors})
+            else:
+                values['user_id'] = user_id
+                products.append(values)
+
+    except (UnicodeDecodeError, csv.Error):
+        raise BulkImportError('request body could not be parsed')
+
+    return products, errors
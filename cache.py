@@ -0,0 +1,369 @@
+"""
+Caches used by the auth, identity and response layers: a bounded in-process
+LRU, and SQLite or file tiers that several workers can share.
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+'''
+LRUCache
+A bounded least-recently-used cache. Every entry can carry its own expiry
+(a unix timestamp); expired entries are treated as misses and dropped on
+access. Hit, miss, eviction and expiration counters are kept so callers can
+report hit ratios. Safe to share between threads of a worker.
+'''
+
+
+class LRUCache:
+    is_shared = False
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at=None):
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def purge(self):
+        # Drop expired entries without waiting for them to be looked up
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (value, expires_at)
+                       in self._entries.items()
+                       if expires_at is not None and expires_at <= now]
+            for key in expired:
+                del self._entries[key]
+            self.expirations += len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self, size=True):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hit_ratio': self.hits / lookups if lookups else 0.0
+        }
+
+
+'''
+Shared tiers let the workers of a host reuse each other's entries. They
+store bytes under string keys with the same get/set/delete/clear/stats
+interface as LRUCache, and trim themselves back to max_size every
+PURGE_INTERVAL writes. SQLiteCache keeps everything in one SQLite file;
+FileCache writes one file per entry. Both are also handy stand-ins for a
+networked cache in tests. Their is_shared flag tells the metrics that
+every worker sees the same entries.
+'''
+
+PURGE_INTERVAL = 100
+
+
+class SQLiteCache:
+    is_shared = True
+
+    def __init__(self, path, max_size=100000, ttl=None):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._local = threading.local()
+
+    def _connection(self):
+        # One connection per thread, reopened after a fork
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            connection = sqlite3.connect(self.path, timeout=5,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, '
+                'value BLOB NOT NULL, expires_at REAL)')
+            self._local.connection = connection
+            self._local.pid = pid
+
+        return self._local.connection
+
+    def get(self, key, default=None):
+        row = self._connection().execute(
+            'SELECT value, expires_at FROM cache WHERE key = ?',
+            (key,)).fetchone()
+
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return row[0]
+
+    def set(self, key, value, expires_at=None):
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+
+        connection = self._connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires_at) '
+            'VALUES (?, ?, ?)', (key, value, expires_at))
+
+        self._writes += 1
+        if self._writes % PURGE_INTERVAL == 0:
+            self.purge()
+
+    def purge(self):
+        connection = self._connection()
+        connection.execute('DELETE FROM cache WHERE expires_at <= ?',
+                           (time.time(),))
+
+        excess = len(self) - self.max_size
+        if excess > 0:
+            connection.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                'ORDER BY expires_at LIMIT ?)', (excess,))
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT count(*) FROM cache').fetchone()[0]
+
+    def stats(self, size=True):
+        # Counting the entries is a query or a directory scan; skip it with
+        # size=False
+        lookups = self.hits + self.misses
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'max_size': self.max_size,
+            'hit_ratio': self.hits / lookups if lookups else 0.0
+        }
+        if size:
+            stats['size'] = len(self)
+        return stats
+
+
+class FileCache:
+    is_shared = True
+
+    # Entries expire by file modification time, so ttl is required
+    def __init__(self, directory, max_size=100000, ttl=300):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl <= time.time():
+                raise FileNotFoundError(path)
+            with open(path, 'rb') as entry:
+                value = entry.read()
+        except OSError:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return value
+
+    def set(self, key, value, expires_at=None):
+        # Write then rename, so readers never see a partial entry
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory,
+                                                 suffix='.tmp')
+        with os.fdopen(descriptor, 'wb') as entry:
+            entry.write(value)
+        os.replace(temporary, self._path(key))
+
+        self._writes += 1
+        if self._writes % PURGE_INTERVAL == 0:
+            self.purge()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.tmp'):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        return entries
+
+    def purge(self):
+        entries = sorted(self._entries())
+        expired = time.time() - self.ttl
+        excess = len(entries) - self.max_size
+
+        for i, (modified, path) in enumerate(entries):
+            if modified > expired and i >= excess:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for modified, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self._entries())
+
+    def stats(self, size=True):
+        # Counting the entries is a query or a directory scan; skip it with
+        # size=False
+        lookups = self.hits + self.misses
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'max_size': self.max_size,
+            'hit_ratio': self.hits / lookups if lookups else 0.0
+        }
+        if size:
+            stats['size'] = len(self)
+        return stats
+
+
+def make_shared_cache(spec, max_size=100000, ttl=300):
+    # None, 'sqlite:<path>' or 'file:<directory>'
+    if not spec:
+        return None
+    if spec.startswith('sqlite:'):
+        return SQLiteCache(spec[len('sqlite:'):], max_size, ttl)
+    if spec.startswith('file:'):
+        return FileCache(spec[len('file:'):], max_size, ttl)
+
+    raise ValueError('unknown shared cache: %s' % spec)
+
+
+'''
+TieredCache
+An LRUCache in front of an optional shared tier. Reads fall through to the
+shared tier and promote what they find; writes go to both. Its size is
+that of the local tier; the shared tier is measured on its own.
+'''
+
+
+class TieredCache:
+    is_shared = False
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key, default=None):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+
+        return default if value is None else value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def __len__(self):
+        return len(self.local)
+
+    def stats(self, size=True):
+        local = self.local.stats(size)
+        hits = local['hits']
+        misses = local['misses']
+
+        stats = {'local': local}
+        if self.shared is not None:
+            stats['shared'] = self.shared.stats(size)
+            hits += stats['shared']['hits']
+            misses = stats['shared']['misses']
+
+        lookups = hits + misses
+        stats['hits'] = hits
+        stats['misses'] = misses
+        stats['hit_ratio'] = hits / lookups if lookups else 0.0
+
+        return stats
@@ -0,0 +1,63 @@
+"""
+Response cache for the public catalog of items for sale.
+"""
+
+import hashlib
+import os
+
+from dotenv import load_dotenv
+
+from cache import LRUCache, TieredCache, make_shared_cache
+from models import DataVersion
+
+load_dotenv()
+
+# Seconds a cached page is kept; a new catalog version retires it at once
+CATALOG_CACHE_TTL = int(os.environ.get('CATALOG_CACHE_TTL', 30))
+CATALOG_CACHE_MAX_SIZE = int(os.environ.get('CATALOG_CACHE_MAX_SIZE', 1000))
+# Optional tier shared by the workers: 'sqlite:<path>' or 'file:<directory>'
+CATALOG_CACHE_SHARED = os.environ.get('CATALOG_CACHE_SHARED')
+CATALOG_CACHE_SHARED_MAX_SIZE = int(
+    os.environ.get('CATALOG_CACHE_SHARED_MAX_SIZE', 10000))
+# Seconds browsers and CDNs may reuse a page without revalidating
+CATALOG_MAX_AGE = int(os.environ.get('CATALOG_MAX_AGE', 30))
+
+# Item fields buyers get to see
+CATALOG_FIELDS = ('id', 'name', 'warranty_period', 'item_description',
+                  'image_link')
+
+CATALOG_VERSION = 'catalog'
+
+'''
+Pages are cached as the encoded response body under their ETag, which
+hashes the catalog version, the cursor and the page size, so a hit costs a
+primary key lookup but neither the item query nor serialization. Creating
+or deleting an item bumps the version once the change is committed, and
+every tier of every worker stops serving the old pages at once; they age
+out through the LRU and the TTL.
+'''
+
+catalog_cache = TieredCache(
+    LRUCache(max_size=CATALOG_CACHE_MAX_SIZE, ttl=CATALOG_CACHE_TTL),
+    make_shared_cache(CATALOG_CACHE_SHARED, CATALOG_CACHE_SHARED_MAX_SIZE,
+                      CATALOG_CACHE_TTL))
+
+
+def make_etag(version, key):
+    return hashlib.sha1(('%s:%r' % (version, key)).encode()).hexdigest()
+
+
+def cached_page(key, build):
+    # Returns (body, etag), calling build() to encode the page on a miss
+    etag = make_etag(DataVersion.current(CATALOG_VERSION), key)
+    body = catalog_cache.get(etag)
+
+    if body is None:
+        body = build()
+        catalog_cache.set(etag, body)
+
+    return body, etag
+
+
+def invalidate_catalog():
+    DataVersion.bump(CATALOG_VERSION)
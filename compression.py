@@ -0,0 +1,143 @@
+"""
+Negotiated gzip/brotli compression of API responses.
+"""
+
+import os
+import zlib
+
+from dotenv import load_dotenv
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+load_dotenv()
+
+# zlib level 1 (fastest) to 9 (smallest)
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+# brotli quality 0 (fastest) to 11 (smallest)
+COMPRESSION_BROTLI_QUALITY = int(
+    os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))
+# Smaller bodies are sent as they are
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 500))
+
+COMPRESSIBLE_MIMETYPES = (
+    'application/json',
+    'application/x-ndjson',
+    'text/csv',
+    'text/html',
+    'text/plain'
+)
+
+'''
+Compressors share one small interface: compress(chunk) returns whatever
+output is ready, flush() forces out everything buffered so far (so
+streamed exports keep flowing) and finish() ends the stream.
+'''
+
+
+class GzipCompressor:
+    def __init__(self, level):
+        # wbits 31 writes a gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk):
+        return self._compressor.compress(chunk)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, chunk):
+        return self._compressor.process(chunk)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def compress_stream(chunks, compressor):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk) + compressor.flush()
+            if data:
+                yield data
+
+        yield compressor.finish()
+    finally:
+        # Lets stream_with_context tear its request context down
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def init_compression(app, level=None, brotli_quality=None, min_size=None):
+    level = level or app.config.get('COMPRESSION_LEVEL', COMPRESSION_LEVEL)
+    brotli_quality = brotli_quality or app.config.get(
+        'COMPRESSION_BROTLI_QUALITY', COMPRESSION_BROTLI_QUALITY)
+    if min_size is None:
+        min_size = app.config.get('COMPRESSION_MIN_SIZE',
+                                  COMPRESSION_MIN_SIZE)
+
+    encodings = {'gzip': lambda: GzipCompressor(level)}
+    if brotli is not None:
+        encodings['br'] = lambda: BrotliCompressor(brotli_quality)
+
+    # Prefer brotli when the client rates both the same
+    offered = [name for name in ('br', 'gzip') if name in encodings]
+
+    @app.after_request
+    def compress_response(response):
+        if response.status_code == 304:
+            response.vary.add('Accept-Encoding')
+            return response
+
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES or \
+                response.status_code < 200 or \
+                response.status_code in (204, 206):
+            return response
+
+        response.vary.add('Accept-Encoding')
+
+        # Skip content that is already encoded or served from a file
+        if 'Content-Encoding' in response.headers or \
+                response.direct_passthrough:
+            return response
+
+        encoding = request.accept_encodings.best_match(offered)
+        if encoding is None:
+            return response
+
+        compressor = encodings[encoding]()
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response,
+                                                compressor)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            response.set_data(compressor.compress(data) +
+                              compressor.finish())
+
+        response.headers['Content-Encoding'] = encoding
+
+        # The compressed bytes differ, so a strong validator has to go
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+        return response
@@ -0,0 +1,72 @@
+"""
+Streams query results as CSV or NDJSON for the export endpoints.
+"""
+
+import csv
+import io
+import os
+from datetime import date
+
+from dotenv import load_dotenv
+
+from serializers import dumps
+
+load_dotenv()
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+
+def format_value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def batched(lines):
+    # Send the first line right away, then group lines into larger chunks
+    lines = iter(lines)
+    for line in lines:
+        yield line
+        break
+
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= EXPORT_BATCH_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+
+    if chunk:
+        yield ''.join(chunk)
+
+
+def csv_lines(fields, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(fields)
+    yield buffer.getvalue()
+
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([format_value(value) for value in row])
+        yield buffer.getvalue()
+
+
+def ndjson_lines(fields, rows):
+    for row in rows:
+        yield dumps(dict(zip(fields, row))).decode('utf-8') + '\n'
+
+
+def stream_export(export_format, fields, rows):
+    # rows is any iterable of tuples in the order of fields
+    if export_format == 'csv':
+        return batched(csv_lines(fields, rows))
+
+    return batched(ndjson_lines(fields, rows))
@@ -0,0 +1,109 @@
+"""
+Resolves the caller of an authenticated request to a local users.id.
+"""
+
+import os
+
+import requests
+from dotenv import load_dotenv
+
+from auth import AuthError
+from cache import LRUCache
+from metrics import timed
+from models import User, on_commit
+
+load_dotenv()
+
+USERINFO_URL = os.environ.get(
+    'USERINFO_URL', 'https://dev-jyqum17r.auth0.com/userinfo')
+USERINFO_TIMEOUT = int(os.environ.get('USERINFO_TIMEOUT', 5))
+IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 300))
+IDENTITY_CACHE_MAX_SIZE = int(os.environ.get('IDENTITY_CACHE_MAX_SIZE', 10000))
+
+'''
+Identity cache
+Maps the JWT 'sub' claim to users.id for IDENTITY_CACHE_TTL seconds so the
+common request path does no outbound HTTP and no user lookup. On a miss the
+subject is looked up in the users table, and /userinfo is only called the
+first time a subject is ever seen.
+'''
+
+identity_cache = LRUCache(
+    max_size=IDENTITY_CACHE_MAX_SIZE,
+    ttl=IDENTITY_CACHE_TTL)
+
+
+def fetch_userinfo(user_token):
+    # Make a request to the userprofile
+    if user_token.split()[0] == 'Bearer':
+        token = user_token
+    else:
+        token = 'Bearer ' + user_token
+
+    try:
+        with timed('userinfo'):
+            response = requests.get(USERINFO_URL,
+                                    headers={'Authorization': token},
+                                    timeout=USERINFO_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    except (requests.RequestException, ValueError):
+        raise AuthError({
+            'code': 'userinfo_unavailable',
+            'description': 'Unable to fetch the user profile.'
+        }, 401)
+
+
+def get_or_create_user(userinfo, sub=None):
+    # The account of this Auth0 subject, else one to link by email, else a
+    # new user
+    sub = sub or userinfo.get('sub')
+    email = userinfo['email']
+    User.insert_if_missing(userinfo['name'], email, sub)
+
+    user = None
+    if sub is not None:
+        user = User.query.filter(User.auth0_sub == sub).one_or_none()
+
+    if user is None:
+        user = User.query.filter(User.email == email).one()
+        if sub is not None and user.auth0_sub is None:
+            user.auth0_sub = sub
+            user.update()
+
+    elif user.email != email and \
+            User.query.filter(User.email == email).first() is None:
+        # The subject's email changed at Auth0; keep the old one if another
+        # account already uses the new one
+        user.email = email
+        user.update()
+
+    if sub is not None:
+        # Only cache the id once the user row is committed
+        user_id = user.id
+        on_commit(lambda: identity_cache.set(sub, user_id))
+
+    return user
+
+
+def resolve_user_id(payload, user_token):
+    sub = payload.get('sub')
+    if sub is None:
+        raise AuthError({
+            'code': 'invalid_claims',
+            'description': 'Token has no subject.'
+        }, 401)
+
+    user_id = identity_cache.get(sub)
+    if user_id is not None:
+        return user_id
+
+    user = User.query.filter(User.auth0_sub == sub).one_or_none()
+    if user is None:
+        # First time we see this subject; cached once it is committed
+        return get_or_create_user(fetch_userinfo(user_token), sub).id
+
+    identity_cache.set(sub, user.id)
+
+    return user.id
@@ -3,6 +3,9 @@ from flask_migrate import Migrate, MigrateCommand
 
 from app import app
 from models import db
+from notifications import REMINDER_BATCH_SIZE, REMINDER_SINK
+from notifications import REMINDER_WINDOW_DAYS, REMINDER_WORKERS
+from notifications import make_sink, run_reminders
 
 migrate = Migrate(app, db)
 manager = Manager(app)
@@ -10,5 +13,24 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.option('-d', '--days', dest='days', type=int,
+                default=REMINDER_WINDOW_DAYS,
+                help='Remind this many days before the warranty ends')
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=REMINDER_BATCH_SIZE,
+                help='Products scanned per batch')
+@manager.option('-w', '--workers', dest='workers', type=int,
+                default=REMINDER_WORKERS,
+                help='Threads rendering and delivering reminders')
+@manager.option('-s', '--sink', dest='sink', default=REMINDER_SINK,
+                help='stdout, file:<path> or smtp://<host>:<port>')
+def send_reminders(days, batch_size, workers, sink):
+    """Queue and deliver warranty expiry reminders"""
+    stats = run_reminders(days=days, batch_size=batch_size,
+                          workers=workers, sink=make_sink(sink))
+
+    print('queued %(queued)d, sent %(sent)d, failed %(failed)d' % stats)
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,458 @@
+"""
+Request metrics: per-endpoint latency histograms, timings of the phases a
+request spends its time in, database pool and cache statistics, served on
+/metrics in the Prometheus text format.
+"""
+
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter, time
+
+from dotenv import load_dotenv
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Directory shared by the gunicorn workers of a host. When set, every worker
+# writes its metrics there and /metrics adds them all up; clear it before
+# the server starts.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+# Seconds between the snapshots a worker writes to METRICS_DIR
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 10))
+# Seconds a worker reuses the entry count of a shared cache store
+METRICS_SHARED_SIZE_INTERVAL = float(
+    os.environ.get('METRICS_SHARED_SIZE_INTERVAL', 60))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+METRICS = {
+    'http_request_duration_seconds': (
+        'histogram', 'Time from receiving a request to sending its headers'),
+    'request_phase_duration_seconds': (
+        'histogram', 'Time a request spent in each phase'),
+    'db_pool_size': ('gauge', 'Connections the pool keeps open'),
+    'db_pool_checked_in': ('gauge', 'Idle connections in the pool'),
+    'db_pool_checked_out': ('gauge', 'Connections in use'),
+    'db_pool_overflow': ('gauge', 'Connections opened beyond the pool size'),
+    'cache_hits_total': ('counter', 'Cache lookups that found an entry'),
+    'cache_misses_total': ('counter', 'Cache lookups that found nothing'),
+    'cache_size': ('gauge', 'Entries in the cache'),
+    'cache_hit_ratio': ('gauge', 'Share of cache lookups that were hits')
+}
+
+POOL_STATS = (
+    ('size', 'db_pool_size'),
+    ('checkedin', 'db_pool_checked_in'),
+    ('checkedout', 'db_pool_checked_out'),
+    ('overflow', 'db_pool_overflow')
+)
+
+'''
+Phase timers
+timed(phase) adds the time spent inside it to the current request's phases
+(jwt_verify, userinfo, sql, serialize). Outside of a request it does
+nothing. The totals are recorded once per request, so a timer costs two
+perf_counter() calls and a dict update.
+'''
+
+
+def add_phase_time(phase, seconds):
+    if has_request_context():
+        phases = g.setdefault('metrics_phases', {})
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed(phase):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        add_phase_time(phase, perf_counter() - start)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    if context is not None:
+        context.metrics_start = perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    start = getattr(context, 'metrics_start', None)
+    if start is not None:
+        add_phase_time('sql', perf_counter() - start)
+
+
+def instrument_engine(engine):
+    if not event.contains(engine, 'before_cursor_execute',
+                          before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+
+'''
+MetricsRegistry
+Histograms recorded by this worker, keyed by metric name and labels, plus
+collectors that read gauges and counters (pool and cache statistics) when a
+snapshot is taken. Labels are tuples of (name, value) pairs.
+'''
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket plus +Inf, not cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.collectors = []
+        self.started = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def add_collector(self, collector):
+        # collector() returns (kind, name, labels, value) samples, where
+        # kind is 'counter', 'gauge' or 'shared'
+        self.collectors.append(collector)
+
+    def snapshot(self):
+        # Workers forked from one master tell their snapshots apart by pid
+        # and start time, since a recycled worker can reuse an old pid
+        pid = os.getpid()
+        if self._pid != pid:
+            self._pid = pid
+            self.started = time()
+
+        with self._lock:
+            histograms = [[name, labels, list(histogram.counts),
+                           histogram.sum]
+                          for (name, labels), histogram
+                          in self.histograms.items()]
+
+        samples = [sample for collector in self.collectors
+                   for sample in collector()]
+
+        return {
+            'pid': pid,
+            'started': self.started,
+            'histograms': histograms,
+            'samples': samples
+        }
+
+
+def pool_collector(name, engine):
+    def collect():
+        samples = []
+        for attribute, metric in POOL_STATS:
+            # NullPool and StaticPool keep no statistics
+            stat = getattr(engine.pool, attribute, None)
+            if callable(stat):
+                samples.append(('gauge', metric, (('engine', name),),
+                                stat()))
+        return samples
+
+    return collect
+
+
+def sampled_len(cache, interval):
+    # Counting the entries of a shared store takes a query or a directory
+    # scan, so the count is reused for interval seconds
+    last = [None, 0.0]
+
+    def size():
+        if time() >= last[1]:
+            last[:] = [len(cache), time() + interval]
+        return last[0]
+
+    return size
+
+
+def cache_collector(name, cache, size_interval=None):
+    # Every worker sees the same entries of a shared store, so its size is
+    # a 'shared' gauge that merge() does not add up. The shared tier of a
+    # TieredCache is reported the same way, labelled tier="shared".
+    if size_interval is None:
+        size_interval = METRICS_SHARED_SIZE_INTERVAL
+    labels = (('cache', name),)
+    is_shared = getattr(cache, 'is_shared', False)
+
+    shared_sizes = []
+    if is_shared:
+        shared_sizes.append((labels, sampled_len(cache, size_interval)))
+    tier = getattr(cache, 'shared', None)
+    if getattr(tier, 'is_shared', False):
+        shared_sizes.append((labels + (('tier', 'shared'),),
+                             sampled_len(tier, size_interval)))
+
+    def collect():
+        stats = cache.stats(size=False)
+        samples = [('counter', 'cache_hits_total', labels, stats['hits']),
+                   ('counter', 'cache_misses_total', labels,
+                    stats['misses'])]
+
+        if not is_shared:
+            samples.append(('gauge', 'cache_size', labels, len(cache)))
+        for size_labels, size in shared_sizes:
+            samples.append(('shared', 'cache_size', size_labels, size()))
+
+        return samples
+
+    return collect
+
+
+'''
+Multi-worker aggregation
+Each worker writes its snapshot to METRICS_DIR/<pid>-<start time>.json at
+most every METRICS_FLUSH_INTERVAL seconds. A worker that reuses the pid of
+an exited one gets a file of its own. Histograms and counters of every file
+are summed, including those of workers that have exited, so totals never go
+backwards while the directory is kept; gauges only count live workers.
+Failing to write a snapshot is logged and never fails the request.
+Shared gauges describe a store all workers use, so the largest value any
+live worker reported is taken instead of the sum.
+'''
+
+
+def snapshot_path(directory, snapshot):
+    return os.path.join(directory, '%d-%d.json' % (
+        snapshot['pid'], snapshot['started'] * 1000))
+
+
+def write_snapshot(directory, snapshot):
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'w') as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(temporary, snapshot_path(directory, snapshot))
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def flush_snapshot(directory, snapshot):
+    try:
+        write_snapshot(directory, snapshot)
+        return True
+    except OSError:
+        logger.exception('could not write metrics to %s', directory)
+        return False
+
+
+def read_snapshots(directory):
+    snapshots = []
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            # Files written before start times were recorded
+            snapshot.setdefault('started', 0.0)
+            snapshots.append(snapshot)
+        except (OSError, ValueError):
+            pass
+    return snapshots
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def labels_key(labels):
+    # Labels come back from JSON as lists of lists
+    return tuple(tuple(pair) for pair in labels)
+
+
+def merge(snapshots):
+    histograms = {}
+    samples = {}
+
+    # Only the newest process with a given pid can still be running
+    latest = {}
+    for snapshot in snapshots:
+        latest[snapshot['pid']] = max(latest.get(snapshot['pid'], 0),
+                                      snapshot['started'])
+
+    for snapshot in snapshots:
+        alive = snapshot['started'] == latest[snapshot['pid']] and (
+            snapshot['pid'] == os.getpid() or is_alive(snapshot['pid']))
+
+        for name, labels, counts, total in snapshot['histograms']:
+            key = (name, labels_key(labels))
+            merged = histograms.setdefault(
+                key, [[0] * len(counts), 0.0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+
+        for kind, name, labels, value in snapshot['samples']:
+            if kind in ('gauge', 'shared') and not alive:
+                continue
+            key = (name, labels_key(labels))
+            if kind == 'shared':
+                samples[key] = max(samples.get(key, 0), value)
+            else:
+                samples[key] = samples.get(key, 0) + value
+
+    # Ratios are derived after summing, they cannot be added up
+    for (name, labels), hits in list(samples.items()):
+        if name == 'cache_hits_total':
+            lookups = hits + samples.get(('cache_misses_total', labels), 0)
+            samples[('cache_hit_ratio', labels)] = \
+                hits / lookups if lookups else 0.0
+
+    return histograms, samples
+
+
+def format_labels(labels):
+    return ','.join('%s="%s"' % (name, str(value).replace('"', '\\"'))
+                    for name, value in labels)
+
+
+def render(histograms, samples, buckets=LATENCY_BUCKETS):
+    lines = []
+    bounds = [str(bucket) for bucket in buckets] + ['+Inf']
+
+    for metric, (kind, description) in METRICS.items():
+        series = histograms if kind == 'histogram' else samples
+        keys = sorted(key for key in series if key[0] == metric)
+        if not keys:
+            continue
+
+        lines.append('# HELP %s %s' % (metric, description))
+        lines.append('# TYPE %s %s' % (metric, kind))
+
+        for key in keys:
+            labels = key[1]
+            if kind != 'histogram':
+                lines.append('%s{%s} %s' % (metric, format_labels(labels),
+                                            series[key]))
+                continue
+
+            counts, total = series[key]
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append('%s_bucket{%s} %d' % (
+                    metric, format_labels(labels + (('le', bound),)),
+                    cumulative))
+            lines.append('%s_sum{%s} %s' % (metric, format_labels(labels),
+                                            total))
+            lines.append('%s_count{%s} %d' % (metric, format_labels(labels),
+                                              cumulative))
+
+    return '\n'.join(lines) + '\n'
+
+
+'''
+init_metrics(app, db, caches) times every request of the app, instruments
+the primary and replica engines, reports the given caches by name and adds
+the /metrics endpoint. Call it before the other extensions register their
+after_request hooks, so the latency includes them.
+'''
+
+
+def init_metrics(app, db, caches=None, directory=None):
+    directory = directory or app.config.get('METRICS_DIR', METRICS_DIR)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    registry = MetricsRegistry()
+    app.extensions['metrics'] = registry
+
+    engines = {'primary': db.engine}
+    for bind in app.config.get('SQLALCHEMY_BINDS') or {}:
+        engines[bind] = db.get_engine(app, bind=bind)
+
+    for name, engine in engines.items():
+        instrument_engine(engine)
+        registry.add_collector(pool_collector(name, engine))
+
+    for name, cache in (caches or {}).items():
+        registry.add_collector(cache_collector(name, cache))
+
+    next_flush = [0.0]
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+
+        endpoint = request.url_rule.rule if request.url_rule else \
+            'unmatched'
+        registry.observe('http_request_duration_seconds',
+                         (('endpoint', endpoint),
+                          ('method', request.method),
+                          ('status', str(response.status_code))),
+                         perf_counter() - start)
+
+        for phase, seconds in g.pop('metrics_phases', {}).items():
+            registry.observe('request_phase_duration_seconds',
+                             (('endpoint', endpoint), ('phase', phase)),
+                             seconds)
+
+        if directory and time() >= next_flush[0]:
+            next_flush[0] = time() + METRICS_FLUSH_INTERVAL
+            # A failing collector must not fail the request either
+            try:
+                flush_snapshot(directory, registry.snapshot())
+            except Exception:
+                logger.exception('could not collect metrics')
+
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        snapshot = registry.snapshot()
+
+        snapshots = [snapshot]
+        if directory:
+            flush_snapshot(directory, snapshot)
+            # This worker's numbers come from memory, even when the write
+            # above failed
+            snapshots += [other for other in read_snapshots(directory)
+                          if (other['pid'], other['started']) !=
+                          (snapshot['pid'], snapshot['started'])]
+
+        histograms, samples = merge(snapshots)
+
+        return Response(render(histograms, samples, registry.buckets),
+                        mimetype='text/plain; version=0.0.4')
+
+    return registry
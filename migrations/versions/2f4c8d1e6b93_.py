@@ -0,0 +1,85 @@
+"""full-text and trigram search over sell_items
+
+Revision ID: 2f4c8d1e6b93
+Revises: 9e6f2a8b1d30
+Create Date: 2026-10-18 18:04:51.316208
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f4c8d1e6b93'
+down_revision = '9e6f2a8b1d30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        # Generated columns need PostgreSQL 12. Adding a stored column
+        # rewrites sell_items, so run this outside of peak hours. Databases
+        # created by create_all already have everything (IF NOT EXISTS).
+        op.execute(
+            "ALTER TABLE sell_items ADD COLUMN IF NOT EXISTS search_vector "
+            "tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('english', "
+            "coalesce(item_description, '')), 'B')) STORED")
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+        with op.get_context().autocommit_block():
+            op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+                       'ix_sell_items_search_vector '
+                       'ON sell_items USING gin (search_vector)')
+            op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+                       'ix_sell_items_name_trgm '
+                       'ON sell_items USING gin (name gin_trgm_ops)')
+
+    elif dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS sell_items_fts USING fts5("
+            "name, item_description, content='sell_items', "
+            "content_rowid='id')")
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS sell_items_fts_insert "
+            "AFTER INSERT ON sell_items "
+            "BEGIN INSERT INTO sell_items_fts(rowid, name, item_description) "
+            "VALUES (new.id, new.name, new.item_description); END")
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS sell_items_fts_delete "
+            "AFTER DELETE ON sell_items "
+            "BEGIN INSERT INTO sell_items_fts("
+            "sell_items_fts, rowid, name, item_description) "
+            "VALUES ('delete', old.id, old.name, old.item_description); END")
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS sell_items_fts_update "
+            "AFTER UPDATE ON sell_items "
+            "BEGIN INSERT INTO sell_items_fts("
+            "sell_items_fts, rowid, name, item_description) "
+            "VALUES ('delete', old.id, old.name, old.item_description); "
+            "INSERT INTO sell_items_fts(rowid, name, item_description) "
+            "VALUES (new.id, new.name, new.item_description); END")
+        # Index the rows that already exist
+        op.execute("INSERT INTO sell_items_fts(sell_items_fts) "
+                   "VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.execute('DROP INDEX CONCURRENTLY IF EXISTS '
+                       'ix_sell_items_name_trgm')
+            op.execute('DROP INDEX CONCURRENTLY IF EXISTS '
+                       'ix_sell_items_search_vector')
+        op.execute('ALTER TABLE sell_items DROP COLUMN search_vector')
+
+    elif dialect == 'sqlite':
+        for trigger in ('insert', 'delete', 'update'):
+            op.execute('DROP TRIGGER IF EXISTS sell_items_fts_' + trigger)
+        op.execute('DROP TABLE IF EXISTS sell_items_fts')
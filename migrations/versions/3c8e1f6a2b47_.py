@@ -0,0 +1,30 @@
+"""add auth0_sub to users
+
+Revision ID: 3c8e1f6a2b47
+Revises: b9dc7c440935
+Create Date: 2026-10-18 09:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c8e1f6a2b47'
+down_revision = 'b9dc7c440935'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('auth0_sub', sa.String(), nullable=True))
+    op.create_index(
+        'ix_users_auth0_sub',
+        'users',
+        ['auth0_sub'],
+        unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_users_auth0_sub', table_name='users')
+    op.drop_column('users', 'auth0_sub')
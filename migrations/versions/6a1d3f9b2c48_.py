@@ -0,0 +1,29 @@
+"""per-user data version for conditional GETs
+
+Revision ID: 6a1d3f9b2c48
+Revises: 2f4c8d1e6b93
+Create Date: 2026-10-18 19:12:37.550194
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a1d3f9b2c48'
+down_revision = '2f4c8d1e6b93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # A constant default does not rewrite the table on PostgreSQL 11+
+    op.add_column('users', sa.Column('data_version',
+                                     sa.Integer(),
+                                     nullable=False,
+                                     server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('data_version')
@@ -0,0 +1,29 @@
+"""index product warranty_end_date per user
+
+Revision ID: 7a2d9c4e5f13
+Revises: 3c8e1f6a2b47
+Create Date: 2026-10-18 11:40:05.218764
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a2d9c4e5f13'
+down_revision = '3c8e1f6a2b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_product_user_id_warranty_end_date',
+        'product',
+        ['user_id', 'warranty_end_date'],
+        unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_product_user_id_warranty_end_date',
+                  table_name='product')
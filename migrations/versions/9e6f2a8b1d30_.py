@@ -0,0 +1,74 @@
+"""index user_id lookups and make users.email unique
+
+Revision ID: 9e6f2a8b1d30
+Revises: d41b7e20c8a5
+Create Date: 2026-10-18 15:31:12.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e6f2a8b1d30'
+down_revision = 'd41b7e20c8a5'
+branch_labels = None
+depends_on = None
+
+
+def create_user_id_indexes(**kw):
+    op.create_index('ix_product_user_id_id',
+                    'product',
+                    ['user_id', 'id'],
+                    unique=False,
+                    **kw)
+    op.create_index('ix_sell_items_user_id_id',
+                    'sell_items',
+                    ['user_id', 'id'],
+                    unique=False,
+                    **kw)
+
+
+def drop_user_id_indexes(**kw):
+    op.drop_index('ix_sell_items_user_id_id',
+                  table_name='sell_items',
+                  **kw)
+    op.drop_index('ix_product_user_id_id',
+                  table_name='product',
+                  **kw)
+
+
+def upgrade():
+    # Duplicate emails have to be merged before this migration, otherwise
+    # making users.email unique fails.
+    if op.get_bind().dialect.name != 'postgresql':
+        create_user_id_indexes()
+        with op.batch_alter_table('users') as batch_op:
+            batch_op.create_unique_constraint('uq_users_email', ['email'])
+        return
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction and does not
+    # block writes while it builds
+    with op.get_context().autocommit_block():
+        create_user_id_indexes(postgresql_concurrently=True)
+        op.create_index('ix_users_email',
+                        'users',
+                        ['email'],
+                        unique=True,
+                        postgresql_concurrently=True)
+
+    # Promote the prebuilt index; this only takes a brief lock
+    op.execute('ALTER TABLE users ADD CONSTRAINT uq_users_email '
+               'UNIQUE USING INDEX ix_users_email')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        with op.batch_alter_table('users') as batch_op:
+            batch_op.drop_constraint('uq_users_email', type_='unique')
+        drop_user_id_indexes()
+        return
+
+    op.drop_constraint('uq_users_email', 'users', type_='unique')
+    with op.get_context().autocommit_block():
+        drop_user_id_indexes(postgresql_concurrently=True)
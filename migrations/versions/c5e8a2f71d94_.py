@@ -0,0 +1,51 @@
+"""track product changes for the reminder scheduler
+
+Revision ID: c5e8a2f71d94
+Revises: 6a1d3f9b2c48
+Create Date: 2026-10-18 21:04:19.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e8a2f71d94'
+down_revision = '6a1d3f9b2c48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows keep a NULL updated_at, so adding the column does not
+    # rewrite the table
+    op.add_column('product', sa.Column('updated_at',
+                                       sa.DateTime(),
+                                       nullable=True))
+    op.add_column('scheduler_state', sa.Column('changed_since',
+                                               sa.DateTime(),
+                                               nullable=True))
+
+    if op.get_bind().dialect.name != 'postgresql':
+        op.create_index('ix_product_updated_at_id',
+                        'product',
+                        ['updated_at', 'id'],
+                        unique=False)
+        return
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction and does not
+    # block writes while it builds
+    with op.get_context().autocommit_block():
+        op.create_index('ix_product_updated_at_id',
+                        'product',
+                        ['updated_at', 'id'],
+                        unique=False,
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_product_updated_at_id', table_name='product')
+    with op.batch_alter_table('scheduler_state') as batch_op:
+        batch_op.drop_column('changed_since')
+    with op.batch_alter_table('product') as batch_op:
+        batch_op.drop_column('updated_at')
@@ -0,0 +1,63 @@
+"""warranty reminders and scheduler state
+
+Revision ID: d41b7e20c8a5
+Revises: 7a2d9c4e5f13
+Create Date: 2026-10-18 14:02:47.550193
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41b7e20c8a5'
+down_revision = '7a2d9c4e5f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('warranty_reminders',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('product_id', sa.Integer(), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('warranty_end_date', sa.Date(),
+                              nullable=False),
+                    sa.Column('created_at', sa.DateTime(), nullable=False),
+                    sa.Column('sent_at', sa.DateTime(), nullable=True),
+                    sa.ForeignKeyConstraint(['product_id'], ['product.id'],
+                                            ondelete='CASCADE'),
+                    sa.ForeignKeyConstraint(['user_id'], ['users.id'],
+                                            ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint(
+                        'product_id', 'warranty_end_date',
+                        name='uq_warranty_reminders_product_end_date')
+                    )
+    op.create_index('ix_warranty_reminders_pending',
+                    'warranty_reminders',
+                    ['id'],
+                    unique=False,
+                    postgresql_where=sa.text('sent_at IS NULL'))
+    op.create_table('scheduler_state',
+                    sa.Column('name', sa.String(), nullable=False),
+                    sa.Column('last_end_date', sa.Date(), nullable=True),
+                    sa.Column('last_product_id', sa.Integer(),
+                              nullable=False),
+                    sa.Column('max_product_id', sa.Integer(),
+                              nullable=False),
+                    sa.Column('updated_at', sa.DateTime(), nullable=True),
+                    sa.PrimaryKeyConstraint('name')
+                    )
+    op.create_index('ix_product_warranty_end_date_id',
+                    'product',
+                    ['warranty_end_date', 'id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_product_warranty_end_date_id', table_name='product')
+    op.drop_table('scheduler_state')
+    op.drop_index('ix_warranty_reminders_pending',
+                  table_name='warranty_reminders')
+    op.drop_table('warranty_reminders')
@@ -0,0 +1,28 @@
+"""versions of shared data for cached responses
+
+Revision ID: e1b4d7a9c302
+Revises: c5e8a2f71d94
+Create Date: 2026-10-18 22:17:45.208613
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1b4d7a9c302'
+down_revision = 'c5e8a2f71d94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('data_versions',
+                    sa.Column('name', sa.String(), nullable=False),
+                    sa.Column('version', sa.Integer(), nullable=False),
+                    sa.PrimaryKeyConstraint('name')
+                    )
+
+
+def downgrade():
+    op.drop_table('data_versions')
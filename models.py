@@ -1,50 +1,329 @@
+import csv
+import io
+import itertools
 import os
-from sqlalchemy import Column, String, Date, Integer, Boolean
-from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import Column, String, Date, DateTime, Integer, Boolean
+from sqlalchemy import DDL, and_, event, exc, or_, orm, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql.expression import UpdateBase
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 from flask_migrate import Migrate
 from flask_bcrypt import Bcrypt
 import json
 from dotenv import load_dotenv
 
+from cache import LRUCache, TieredCache, make_shared_cache
+
 load_dotenv()
 
 database_name = "warranty"
 database_path = os.environ.get('database_uri')
+# Comma separated read replica URIs; none keeps every query on the primary
+replica_paths = [path.strip() for path in os.environ.get(
+    'DATABASE_REPLICA_URIS', '').split(',') if path.strip()]
+# Seconds a user's reads stay on the primary after they change data
+READ_YOUR_WRITES_WINDOW = int(os.environ.get('READ_YOUR_WRITES_WINDOW', 5))
+# Optional tier shared by the workers, so a write on one worker keeps the
+# user's reads on the primary in all of them: 'sqlite:<path>' or
+# 'file:<directory>'
+READ_YOUR_WRITES_SHARED = os.environ.get('READ_YOUR_WRITES_SHARED')
+
+# 'default' keeps a pool per worker; 'pgbouncer' leaves pooling to PgBouncer
+DB_POOL_PROFILE = os.environ.get('DB_POOL_PROFILE', 'default')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get(
+    'DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+# Milliseconds; 0 disables the timeout
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 30000))
+
+
+'''
+RoutingSession -- sends the queries of read-only requests to a replica.
+use_replica() pins the session to the next replica, round-robin, for the
+rest of the request. Flushes and INSERT/UPDATE/DELETE statements always run
+on the primary, as does everything before the pin. The session is removed
+when the request ends, which drops the pin.
+'''
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing and \
+                not isinstance(clause, UpdateBase):
+            return replica
+
+        return super(RoutingSession, self).get_bind(mapper, clause)
 
-db = SQLAlchemy()
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
 bcrypt = Bcrypt()
 
+# Users who changed data within the last READ_YOUR_WRITES_WINDOW seconds
+recent_writers = TieredCache(
+    LRUCache(max_size=10000, ttl=READ_YOUR_WRITES_WINDOW),
+    make_shared_cache(READ_YOUR_WRITES_SHARED, 100000,
+                      READ_YOUR_WRITES_WINDOW))
+
+
+def use_replica():
+    replicas = current_app.extensions.get('replicas')
+    if replicas is not None:
+        db.session.info['replica'] = db.get_engine(
+            current_app, bind=next(replicas))
+
+
+def note_write(user_id):
+    # Shared tiers store bytes under string keys
+    recent_writers.set(str(user_id), b'1')
+
+
+def wrote_recently(user_id):
+    return recent_writers.get(str(user_id)) is not None
+
+
+'''
+Unit of work -- begin_unit_of_work() hands the session's transaction to the
+caller (create_app opens one per request). The model helpers then only
+flush, so ids and constraint errors still surface at the call site, and
+end_unit_of_work() makes the single commit or rolls everything back.
+Outside a unit of work (manage.py, scripts) the helpers commit as before.
+'''
+
+
+def in_unit_of_work():
+    return db.session.info.get('unit_of_work', False)
+
+
+def begin_unit_of_work():
+    db.session.info['unit_of_work'] = True
+    db.session.info['on_commit'] = []
+
+
+def end_unit_of_work(commit=True):
+    session = db.session
+    if not session.info.pop('unit_of_work', False):
+        return
+
+    callbacks = session.info.pop('on_commit', [])
+    if not commit:
+        session.rollback()
+        return
+
+    try:
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+
+    for callback in callbacks:
+        callback()
+
+
+def on_commit(callback):
+    # Run callback once the current changes are committed
+    if in_unit_of_work():
+        db.session.info['on_commit'].append(callback)
+    else:
+        callback()
+
+
+def save():
+    # Commit now, or flush and leave the commit to the unit of work
+    if in_unit_of_work():
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+'''
+engine_options(database_path): create_engine() arguments for the pool
+profile. The default profile pre-pings and recycles pooled connections so
+workers recover from a database failover, and sets statement_timeout when
+the connection starts. PgBouncer in transaction mode rejects that startup
+parameter and already pools server connections, so the pgbouncer profile
+opens a connection per checkout and sets the timeout per transaction
+instead (see install_engine_events).
+'''
+
+
+def engine_options(database_path, profile=DB_POOL_PROFILE):
+    if not database_path or database_path.startswith('sqlite'):
+        return {}
+
+    if profile == 'pgbouncer':
+        return {'poolclass': NullPool}
+
+    options = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
+
+    if database_path.startswith('postgres') and DB_STATEMENT_TIMEOUT:
+        options['connect_args'] = {
+            'options': '-c statement_timeout=%d' % DB_STATEMENT_TIMEOUT}
+
+    return options
+
+
+def record_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+def check_pid(dbapi_connection, connection_record, connection_proxy):
+    # A connection inherited through fork (gunicorn --preload) shares its
+    # socket with the parent: drop it without closing it and reconnect
+    pid = os.getpid()
+    if connection_record.info['pid'] != pid:
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            'Connection record belongs to pid %s, attempting to check out '
+            'in pid %s' % (connection_record.info['pid'], pid))
+
+
+def set_local_statement_timeout(connection):
+    connection.execute(
+        'SET LOCAL statement_timeout = %d' % DB_STATEMENT_TIMEOUT)
+
+
+def install_engine_events(engine, profile=DB_POOL_PROFILE):
+    if engine.dialect.name == 'sqlite':
+        return
+
+    if not event.contains(engine, 'connect', record_pid):
+        event.listen(engine, 'connect', record_pid)
+        event.listen(engine, 'checkout', check_pid)
+
+    if profile == 'pgbouncer' and DB_STATEMENT_TIMEOUT and \
+            engine.dialect.name == 'postgresql' and \
+            not event.contains(engine, 'begin', set_local_statement_timeout):
+        event.listen(engine, 'begin', set_local_statement_timeout)
+
+
 '''
 setup_db(app): Binds flask app and SQLAlchemy
 '''
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, replica_paths=replica_paths):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS",
+                          engine_options(database_path))
+    # Replicas are binds without tables of their own; see RoutingSession
+    replicas = ['replica_%d' % i for i in range(len(replica_paths))]
+    app.config["SQLALCHEMY_BINDS"] = dict(zip(replicas, replica_paths))
+    app.extensions['replicas'] = itertools.cycle(replicas) \
+        if replicas else None
     db.app = app
     db.init_app(app)
-    db.create_all()
+    install_engine_events(db.engine)
+    for replica in replicas:
+        install_engine_events(db.get_engine(app, bind=replica))
+    db.create_all(bind=None)
+
+    # Don't leave pooled connections behind for forked workers to inherit
+    if db.engine.dialect.name != 'sqlite':
+        db.engine.dispose()
 
     migrate = Migrate(app, db)
 
 
+'''
+ReadQuery -- ORM-free read model for the listing endpoints. It wraps a Core
+select() of plain columns and maps each row straight to a response dict, so
+listing a row allocates neither an identity-mapped instance nor its state.
+Only the filter/order_by/limit/offset/all subset of Query is supported;
+writes keep going through the model classes below.
+'''
+
+
+class ReadQuery:
+    def __init__(self, columns, statement=None):
+        self.columns = columns
+        if statement is None:
+            statement = select(columns)
+        self.statement = statement
+
+    def filter(self, *criteria):
+        return ReadQuery(self.columns, self.statement.where(and_(*criteria)))
+
+    def order_by(self, *clauses):
+        return ReadQuery(self.columns, self.statement.order_by(*clauses))
+
+    def limit(self, limit):
+        return ReadQuery(self.columns, self.statement.limit(limit))
+
+    def offset(self, offset):
+        return ReadQuery(self.columns, self.statement.offset(offset))
+
+    def all(self):
+        keys = [column.key for column in self.columns]
+        result = db.session.execute(self.statement)
+
+        return [dict(zip(keys, row)) for row in result]
+
+
+def read_query(model, fields=None):
+    # SELECT the model's listing fields, or only the requested ones
+    table = model.__table__
+
+    return ReadQuery([table.c[field] for field in fields or model.FIELDS])
+
+
+def project_rows(rows, fields):
+    # Drop sort keys that were only selected to build cursors
+    if fields is None or not rows or len(rows[0]) == len(fields):
+        return rows
+
+    return [{field: row[field] for field in fields} for row in rows]
+
+
 '''
 Product table -- Only keeps track of products that a user wants to keep track
 of Rows: id (Integer, primary_key), name (String), date_purchased (Date),
 warranty_end_date (Date) If period of warranty is provided then we calculate
-warranty_end_date and store in DB
+warranty_end_date and store in DB. updated_at (DateTime) lets the reminder
+scheduler find products changed since its last run
 '''
 
 
 class Product(db.Model):
     __tablename__ = 'product'
+    __table_args__ = (
+        db.Index('ix_product_user_id_warranty_end_date',
+                 'user_id', 'warranty_end_date'),
+        db.Index('ix_product_warranty_end_date_id',
+                 'warranty_end_date', 'id'),
+        db.Index('ix_product_user_id_id', 'user_id', 'id'),
+        db.Index('ix_product_updated_at_id', 'updated_at', 'id'),
+    )
+
+    # Fields clients can select with ?fields=
+    FIELDS = ('id', 'name', 'date_purchased', 'warranty_end_date', 'user_id')
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     date_purchased = Column(Date)
     warranty_end_date = Column(Date)
     user_id = Column(Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+    updated_at = Column(DateTime, default=datetime.utcnow,
+                        onupdate=datetime.utcnow)
 
     # Initialize a product
     def __init__(self, name, date_purchased, warranty_end_date, user_id):
@@ -56,19 +335,77 @@ class Product(db.Model):
     # Insert the product into db
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        save()
 
     # Update the product and commit to db
     def update(self):
-        db.session.commit()
+        save()
 
     # Delete a product from db and commit changes
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        save()
+
+    # Insert many products in one transaction. Rows are dicts with the
+    # column values; PostgreSQL streams large batches through COPY and
+    # everything else uses chunked multi-row INSERTs.
+    @staticmethod
+    def bulk_insert(rows, chunk_size=1000):
+        columns = ('name', 'date_purchased', 'warranty_end_date', 'user_id',
+                   'updated_at')
+        now = datetime.utcnow()
+        rows = [dict(row, updated_at=now) for row in rows]
+        connection = db.session.connection()
+
+        if connection.dialect.name == 'postgresql' and len(rows) > chunk_size:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow([row[column] for column in columns])
+            buffer.seek(0)
+
+            cursor = connection.connection.cursor()
+            cursor.copy_expert(
+                'COPY product (%s) FROM STDIN WITH (FORMAT csv)' %
+                ', '.join(columns), buffer)
+        else:
+            if connection.dialect.name == 'sqlite':
+                # Stay under SQLite's bound parameter limit
+                chunk_size = min(chunk_size, 999 // len(columns))
+
+            table = Product.__table__
+            for start in range(0, len(rows), chunk_size):
+                connection.execute(
+                    table.insert().values(rows[start:start + chunk_size]))
+
+        save()
+
+        return len(rows)
+
+    # Set-based update of every product matching criteria
+    @staticmethod
+    def update_where(criteria, values):
+        count = Product.query.filter(*criteria).update(
+            values, synchronize_session=False)
+        save()
+
+        return count
+
+    # Set-based delete of every product matching criteria
+    @staticmethod
+    def delete_where(criteria):
+        count = Product.query.filter(*criteria).delete(
+            synchronize_session=False)
+        save()
+
+        return count
+
+    # Create formatted response for pagination, optionally limited to the
+    # requested fields
+    def format(self, fields=None):
+        if fields is not None:
+            return {field: getattr(self, field) for field in fields}
 
-    # Create formatted response for pagination
-    def format(self):
         return {
             'id': self.id,
             'name': self.name,
@@ -83,12 +420,15 @@ User table -- Keeps track of whether the user is a buyer or seller (NOTE: not
 sure if we need this yet need to look into Auth0). A Buyer can upload their
 product to product table, a seller can only upload their item to the Item table
 Rows: id (Integer, primary_key), user_name (String), product_id
-(db.relationship "Product"), isSeller (Boolean)
+(db.relationship "Product"), isSeller (Boolean), auth0_sub (String, unique)
 '''
 
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.UniqueConstraint('email', name='uq_users_email'),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
@@ -100,26 +440,78 @@ class User(db.Model):
         passive_deletes=True)
 
     email = db.Column(String, nullable=False)
+    # Auth0 subject ('sub' claim) used to resolve tokens to a user
+    auth0_sub = Column(String, index=True, unique=True)
+    # Bumped by every request that changes the user's data; list ETags
+    # are derived from it
+    data_version = Column(Integer, nullable=False, default=0,
+                          server_default='0')
     items = db.relationship(
         'Items_for_Sale',
         backref='user',
         lazy=True,
         passive_deletes=True)
 
-    def __init__(self, name, email):
+    def __init__(self, name, email, auth0_sub=None):
         self.name = name
         self.email = email
+        self.auth0_sub = auth0_sub
 
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        save()
+
+    # Create the user unless one with this email or Auth0 subject already
+    # exists. This is a single INSERT ... ON CONFLICT DO NOTHING on
+    # PostgreSQL, so concurrent first logins cannot race each other.
+    @staticmethod
+    def insert_if_missing(name, email, auth0_sub=None):
+        values = {'name': name, 'email': email, 'auth0_sub': auth0_sub}
+
+        if db.session.connection().dialect.name == 'postgresql':
+            # No conflict target: covers uq_users_email and the unique
+            # index on auth0_sub
+            db.session.execute(
+                pg_insert(User.__table__).values(**values).
+                on_conflict_do_nothing())
+            save()
+            return
+
+        existing = User.query.filter(User.email == email)
+        if auth0_sub is not None:
+            existing = User.query.filter(
+                or_(User.email == email, User.auth0_sub == auth0_sub))
+
+        if existing.first() is None:
+            # A savepoint keeps a lost race from undoing the whole request
+            try:
+                with db.session.begin_nested():
+                    db.session.add(User(**values))
+            except IntegrityError:
+                pass
+            save()
 
     def update(self):
-        db.session.commit()
+        save()
 
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        save()
+
+    # Current data version of a user, 0 for unknown users
+    @staticmethod
+    def data_version_of(user_id):
+        version = db.session.query(User.data_version).filter(
+            User.id == user_id).scalar()
+
+        return version or 0
+
+    @staticmethod
+    def bump_data_version(user_id):
+        User.query.filter(User.id == user_id).update(
+            {User.data_version: User.data_version + 1},
+            synchronize_session=False)
+        save()
 
     def is_correct_password(self, password):
         # This function checks if @arg:password matches the hashed password
@@ -143,6 +535,13 @@ phone (String), email (String), user (db.relationship, "User")
 
 class Items_for_Sale(db.Model):
     __tablename__ = 'sell_items'
+    __table_args__ = (
+        db.Index('ix_sell_items_user_id_id', 'user_id', 'id'),
+    )
+
+    # Fields clients can select with ?fields=
+    FIELDS = ('id', 'name', 'warranty_period', 'item_description',
+              'image_link', 'user_id')
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
@@ -160,23 +559,35 @@ class Items_for_Sale(db.Model):
             image_link,
             user_id):
         self.name = name
-        self.warranty_period = warranty_period,
-        self.item_description = item_description,
+        self.warranty_period = warranty_period
+        self.item_description = item_description
         self.image_link = image_link
         self.user_id = user_id
 
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        save()
 
     def update(self):
-        db.session.commit()
+        save()
 
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        save()
+
+    # Set-based delete of every item matching criteria
+    @staticmethod
+    def delete_where(criteria):
+        count = Items_for_Sale.query.filter(*criteria).delete(
+            synchronize_session=False)
+        save()
+
+        return count
+
+    def format(self, fields=None):
+        if fields is not None:
+            return {field: getattr(self, field) for field in fields}
 
-    def format(self):
         return {
             'id': self.id,
             'name': self.name,
@@ -185,3 +596,153 @@ class Items_for_Sale(db.Model):
             'image_link': self.image_link,
             'user_id': self.user_id
         }
+
+
+'''
+Full-text search structures for sell_items, created along with the table
+(the migration adds them to existing databases). PostgreSQL keeps a
+weighted tsvector of name and item_description in a generated column with a
+GIN index, plus a trigram index on name for prefix and typo matching.
+SQLite gets an external-content FTS5 table kept in sync by triggers.
+'''
+
+ITEM_SEARCH_DDL = {
+    'postgresql': [
+        "ALTER TABLE sell_items ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(item_description, '')),"
+        " 'B')) STORED",
+        "CREATE INDEX ix_sell_items_search_vector ON sell_items "
+        "USING gin (search_vector)",
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX ix_sell_items_name_trgm ON sell_items "
+        "USING gin (name gin_trgm_ops)"
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS sell_items_fts USING fts5("
+        "name, item_description, content='sell_items', content_rowid='id')",
+        "CREATE TRIGGER sell_items_fts_insert AFTER INSERT ON sell_items "
+        "BEGIN INSERT INTO sell_items_fts(rowid, name, item_description) "
+        "VALUES (new.id, new.name, new.item_description); END",
+        "CREATE TRIGGER sell_items_fts_delete AFTER DELETE ON sell_items "
+        "BEGIN INSERT INTO sell_items_fts("
+        "sell_items_fts, rowid, name, item_description) "
+        "VALUES ('delete', old.id, old.name, old.item_description); END",
+        "CREATE TRIGGER sell_items_fts_update AFTER UPDATE ON sell_items "
+        "BEGIN INSERT INTO sell_items_fts("
+        "sell_items_fts, rowid, name, item_description) "
+        "VALUES ('delete', old.id, old.name, old.item_description); "
+        "INSERT INTO sell_items_fts(rowid, name, item_description) "
+        "VALUES (new.id, new.name, new.item_description); END"
+    ]
+}
+
+for dialect, statements in ITEM_SEARCH_DDL.items():
+    for statement in statements:
+        event.listen(Items_for_Sale.__table__, 'after_create',
+                     DDL(statement).execute_if(dialect=dialect))
+
+event.listen(Items_for_Sale.__table__, 'after_drop',
+             DDL('DROP TABLE IF EXISTS sell_items_fts').execute_if(
+                 dialect='sqlite'))
+
+
+'''
+Reminder table -- One row per warranty expiry reminder queued by the
+notification scheduler. The unique (product_id, warranty_end_date) pair makes
+queueing idempotent, and sent_at stays empty until the reminder is delivered.
+Rows: id (Integer, primary_key), product_id (Integer), user_id (Integer),
+warranty_end_date (Date), created_at (DateTime), sent_at (DateTime)
+'''
+
+
+class Reminder(db.Model):
+    __tablename__ = 'warranty_reminders'
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'warranty_end_date',
+                            name='uq_warranty_reminders_product_end_date'),
+        db.Index('ix_warranty_reminders_pending', 'id',
+                 postgresql_where=db.text('sent_at IS NULL')),
+    )
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(
+        Integer,
+        db.ForeignKey('product.id', ondelete='CASCADE'),
+        nullable=False)
+    user_id = Column(
+        Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False)
+    warranty_end_date = Column(Date, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = Column(DateTime)
+
+
+'''
+SchedulerState table -- High-water marks of the notification scheduler so
+every run continues where the previous one stopped.
+Rows: name (String, primary_key), last_end_date (Date), last_product_id
+(Integer), max_product_id (Integer), changed_since (DateTime), updated_at
+(DateTime)
+'''
+
+
+class SchedulerState(db.Model):
+    __tablename__ = 'scheduler_state'
+
+    name = Column(String, primary_key=True)
+    last_end_date = Column(Date)
+    last_product_id = Column(Integer, nullable=False, default=0)
+    max_product_id = Column(Integer, nullable=False, default=0)
+    changed_since = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow,
+                        onupdate=datetime.utcnow)
+
+    def __init__(self, name):
+        self.name = name
+        self.last_product_id = 0
+        self.max_product_id = 0
+
+
+'''
+DataVersion table -- Versions of data shared by every user, such as the
+public catalog. Cached responses are keyed on the version, so bumping it
+retires them in every worker at once.
+Rows: name (String, primary_key), version (Integer)
+'''
+
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+    def __init__(self, name, version=0):
+        self.name = name
+        self.version = version
+
+    # Current version of name, 0 until it is first bumped
+    @staticmethod
+    def current(name):
+        version = db.session.query(DataVersion.version).filter(
+            DataVersion.name == name).scalar()
+
+        return version or 0
+
+    @staticmethod
+    def bump(name):
+        query = DataVersion.query.filter(DataVersion.name == name)
+        increment = {DataVersion.version: DataVersion.version + 1}
+
+        if not query.update(increment, synchronize_session=False):
+            # First bump; a savepoint keeps a lost race from undoing the
+            # caller's transaction
+            try:
+                with db.session.begin_nested():
+                    db.session.add(DataVersion(name, 1))
+            except IntegrityError:
+                query.update(increment, synchronize_session=False)
+        save()
@@ -0,0 +1,304 @@
+"""
+Warranty expiry reminders: an incremental scanner that queues reminders for
+products entering the notification window, and a worker pool that renders
+and delivers them through a pluggable sink.
+"""
+
+import json
+import logging
+import os
+import smtplib
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from email.message import EmailMessage
+
+from dotenv import load_dotenv
+from sqlalchemy import and_, func, tuple_
+
+from models import db, Product, User, Reminder, SchedulerState
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REMINDER_WINDOW_DAYS = int(os.environ.get('REMINDER_WINDOW_DAYS', 30))
+REMINDER_BATCH_SIZE = int(os.environ.get('REMINDER_BATCH_SIZE', 1000))
+REMINDER_WORKERS = int(os.environ.get('REMINDER_WORKERS', 4))
+REMINDER_SINK = os.environ.get('REMINDER_SINK', 'stdout')
+REMINDER_SENDER = os.environ.get('REMINDER_SENDER',
+                                 'reminders@warranty-tracker.local')
+# Seconds a product change may take to commit; changed products are
+# rescanned this far back so a slow transaction is not missed
+REMINDER_CHANGE_OVERLAP = int(os.environ.get('REMINDER_CHANGE_OVERLAP', 300))
+
+SCHEDULER_NAME = 'expiry_reminders'
+
+'''
+Sinks deliver rendered reminders. They are called from the worker threads,
+so they must be thread safe and must not touch the database session.
+'''
+
+
+class StdoutSink:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        with self._lock:
+            sys.stdout.write(json.dumps(message) + '\n')
+
+
+class FileSink:
+    # Appends one JSON document per reminder
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        with self._lock:
+            with open(self.path, 'a') as sink_file:
+                sink_file.write(json.dumps(message) + '\n')
+
+
+class SMTPSink:
+    # Works against a local stub such as `python -m aiosmtpd -n`
+    def __init__(self, host, port, sender=REMINDER_SENDER):
+        self.host = host
+        self.port = port
+        self.sender = sender
+
+    def send(self, message):
+        email = EmailMessage()
+        email['From'] = self.sender
+        email['To'] = message['to']
+        email['Subject'] = message['subject']
+        email.set_content(message['body'])
+
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(email)
+
+
+def make_sink(spec):
+    # 'stdout', 'file:<path>' or 'smtp://<host>:<port>'
+    if spec == 'stdout':
+        return StdoutSink()
+    if spec.startswith('file:'):
+        return FileSink(spec[len('file:'):])
+    if spec.startswith('smtp://'):
+        host, _, port = spec[len('smtp://'):].partition(':')
+        return SMTPSink(host, int(port or 25))
+
+    raise ValueError('unknown reminder sink: %s' % spec)
+
+
+def render_reminder(row):
+    reminder_id, email, user_name, product_name, warranty_end_date = row
+
+    return {
+        'reminder_id': reminder_id,
+        'to': email,
+        'subject': 'The warranty for %s ends on %s' % (
+            product_name, warranty_end_date.isoformat()),
+        'body': 'Hi %s,\n\nthe warranty for your %s ends on %s.\n' % (
+            user_name, product_name, warranty_end_date.isoformat())
+    }
+
+
+def deliver(sink, row):
+    try:
+        sink.send(render_reminder(row))
+        return True
+
+    except Exception:
+        logger.exception('could not deliver reminder %s', row[0])
+        return False
+
+
+def get_state():
+    state = SchedulerState.query.get(SCHEDULER_NAME)
+
+    if state is None:
+        # First run: the window scan covers every existing product, so the
+        # new-product scan only has to look at rows created from now on
+        state = SchedulerState(SCHEDULER_NAME)
+        state.max_product_id = db.session.query(
+            func.coalesce(func.max(Product.id), 0)).scalar()
+        db.session.add(state)
+        db.session.commit()
+
+    return state
+
+
+def queue_reminders(rows):
+    # Insert reminders that do not exist yet; safe to repeat
+    product_ids = [row.id for row in rows]
+    existing = set(Reminder.query.with_entities(
+        Reminder.product_id, Reminder.warranty_end_date).filter(
+        Reminder.product_id.in_(product_ids)))
+
+    reminders = [{
+        'product_id': row.id,
+        'user_id': row.user_id,
+        'warranty_end_date': row.warranty_end_date
+    } for row in rows
+        if (row.id, row.warranty_end_date) not in existing and row.user_id]
+
+    if reminders:
+        db.session.execute(Reminder.__table__.insert(), reminders)
+
+    return len(reminders)
+
+
+def fetch_batch(query, batch_size, *order_by):
+    return query.with_entities(
+        Product.id, Product.user_id, Product.warranty_end_date,
+        Product.updated_at).order_by(*order_by).limit(batch_size).all()
+
+
+def scan_window(state, today, window_end, batch_size):
+    # Walk products entering the window in (warranty_end_date, id) order,
+    # resuming after the high-water mark of the previous run
+    queued = 0
+
+    while True:
+        query = Product.query.filter(
+            Product.warranty_end_date >= today,
+            Product.warranty_end_date <= window_end)
+
+        if state.last_end_date is not None:
+            query = query.filter(
+                tuple_(Product.warranty_end_date, Product.id) >
+                tuple_(state.last_end_date, state.last_product_id))
+
+        rows = fetch_batch(query, batch_size,
+                           Product.warranty_end_date, Product.id)
+        if not rows:
+            return queued
+
+        queued += queue_reminders(rows)
+        state.last_end_date = rows[-1].warranty_end_date
+        state.last_product_id = rows[-1].id
+        db.session.commit()
+
+
+def scan_new_products(state, today, window_end, batch_size, max_product_id):
+    # Products created since the last run can already be inside the part of
+    # the window the high-water mark has passed; find them by id
+    queued = 0
+
+    while True:
+        query = Product.query.filter(
+            Product.id > state.max_product_id,
+            Product.id <= max_product_id,
+            Product.warranty_end_date >= today,
+            Product.warranty_end_date <= window_end)
+
+        rows = fetch_batch(query, batch_size, Product.id)
+        if not rows:
+            break
+
+        queued += queue_reminders(rows)
+        state.max_product_id = rows[-1].id
+        db.session.commit()
+
+    state.max_product_id = max_product_id
+    db.session.commit()
+
+    return queued
+
+
+def scan_changed_products(state, today, window_end, batch_size, started):
+    # Products whose end date changed since the last run can move into the
+    # part of the window the high-water mark has passed; find them by
+    # updated_at. Products that already have their reminder are skipped.
+    queued = 0
+
+    if state.changed_since is not None:
+        last = (state.changed_since -
+                timedelta(seconds=REMINDER_CHANGE_OVERLAP), 0)
+
+        while True:
+            query = Product.query.filter(
+                tuple_(Product.updated_at, Product.id) > tuple_(*last),
+                Product.warranty_end_date >= today,
+                Product.warranty_end_date <= window_end)
+
+            rows = fetch_batch(query, batch_size,
+                               Product.updated_at, Product.id)
+            if not rows:
+                break
+
+            queued += queue_reminders(rows)
+            last = (rows[-1].updated_at, rows[-1].id)
+            db.session.commit()
+
+    state.changed_since = started
+    db.session.commit()
+
+    return queued
+
+
+def deliver_pending(sink, workers, batch_size):
+    # Fan rendering and delivery out to a thread pool; only this thread
+    # talks to the database
+    sent = failed = 0
+    last_id = 0
+    # Reminders for an end date the product no longer has are not sent
+    current = and_(Product.id == Reminder.product_id,
+                   Product.warranty_end_date == Reminder.warranty_end_date)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            rows = db.session.query(
+                Reminder.id, User.email, User.name, Product.name,
+                Reminder.warranty_end_date).join(
+                Product, current).join(
+                User, User.id == Reminder.user_id).filter(
+                Reminder.sent_at.is_(None),
+                Reminder.id > last_id).order_by(
+                Reminder.id).limit(batch_size).all()
+
+            if not rows:
+                break
+
+            last_id = rows[-1][0]
+            results = list(pool.map(lambda row: deliver(sink, row), rows))
+            delivered = [row[0] for row, ok in zip(rows, results) if ok]
+
+            if delivered:
+                Reminder.query.filter(Reminder.id.in_(delivered)).update(
+                    {'sent_at': datetime.utcnow()}, synchronize_session=False)
+                db.session.commit()
+
+            sent += len(delivered)
+            failed += len(rows) - len(delivered)
+
+    return sent, failed
+
+
+def run_reminders(days=REMINDER_WINDOW_DAYS, batch_size=REMINDER_BATCH_SIZE,
+                  workers=REMINDER_WORKERS, sink=None, today=None):
+    # One incremental, idempotent scheduler pass
+    sink = sink or make_sink(REMINDER_SINK)
+    today = today or date.today()
+    window_end = today + timedelta(days=days)
+
+    state = get_state()
+    started = datetime.utcnow()
+    max_product_id = db.session.query(
+        func.coalesce(func.max(Product.id), 0)).scalar()
+
+    queued = scan_window(state, today, window_end, batch_size)
+    queued += scan_new_products(state, today, window_end, batch_size,
+                                max_product_id)
+    queued += scan_changed_products(state, today, window_end, batch_size,
+                                    started)
+    sent, failed = deliver_pending(sink, workers, batch_size)
+
+    return {
+        'queued': queued,
+        'sent': sent,
+        'failed': failed
+    }
@@ -0,0 +1,68 @@
+"""
+Keyset (cursor) pagination helpers for the listing endpoints.
+"""
+
+import base64
+import json
+from datetime import date
+
+from sqlalchemy import Date, Integer, tuple_
+
+MAX_PAGE_SIZE = 100
+
+'''
+Cursors are the sort-key values of the last row on a page, JSON encoded and
+base64url wrapped so clients treat them as opaque. The next page seeks past
+those values with a row-value comparison, so it is an index range scan that
+costs the same no matter how deep the client has scrolled.
+'''
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, date) else v for v in values]
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    # Raises ValueError for anything that is not one of our cursors
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (TypeError, UnicodeError, ValueError):
+        raise ValueError('malformed cursor')
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError('cursor does not match the sort order')
+
+    # Each value has to have the type of its sort column
+    decoded = []
+    for value, column in zip(values, columns):
+        if isinstance(column.type, Date) and isinstance(value, str):
+            decoded.append(date.fromisoformat(value))
+        elif isinstance(column.type, Integer) and \
+                isinstance(value, int) and not isinstance(value, bool):
+            decoded.append(value)
+        else:
+            raise ValueError('unexpected cursor value')
+
+    return decoded
+
+
+def seek_page(query, columns, cursor, limit):
+    # Returns the rows after the cursor and the cursor for the next page
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        query = query.filter(tuple_(*columns) > tuple_(*values))
+
+    # Fetch one extra row to know whether there is a next page
+    rows = query.order_by(*columns).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(
+            [rows[-1][column.key] for column in columns])
+
+    return rows, next_cursor
@@ -0,0 +1,31 @@
+"""
+Server-side cache of encoded list responses, per user.
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+from cache import LRUCache, TieredCache, make_shared_cache
+
+load_dotenv()
+
+RESPONSE_CACHE_MAX_SIZE = int(os.environ.get('RESPONSE_CACHE_MAX_SIZE', 1000))
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+# Optional tier shared by the workers: 'sqlite:<path>' or 'file:<directory>'
+RESPONSE_CACHE_SHARED = os.environ.get('RESPONSE_CACHE_SHARED')
+RESPONSE_CACHE_SHARED_MAX_SIZE = int(
+    os.environ.get('RESPONSE_CACHE_SHARED_MAX_SIZE', 100000))
+
+'''
+Entries are keyed by the listing's ETag, which hashes the user, their data
+version and the request URL, plus today's date for /products/expiring. A
+write bumps the version, so exactly that user's entries stop matching in
+every tier and every worker at once, and a new day does the same for the
+expiry listing; stale entries age out through the LRU and the TTL.
+'''
+
+response_cache = TieredCache(
+    LRUCache(max_size=RESPONSE_CACHE_MAX_SIZE, ttl=RESPONSE_CACHE_TTL),
+    make_shared_cache(RESPONSE_CACHE_SHARED, RESPONSE_CACHE_SHARED_MAX_SIZE,
+                      RESPONSE_CACHE_TTL))
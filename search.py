@@ -0,0 +1,63 @@
+"""
+Ranked full-text search over a seller's items (see ITEM_SEARCH_DDL in
+models.py for the indexes behind it).
+"""
+
+import re
+
+from sqlalchemy import text
+
+from models import db, Items_for_Sale
+
+# Longer queries are cut to this many words
+MAX_SEARCH_TERMS = 8
+
+ITEM_COLUMNS = ', '.join('sell_items.' + field
+                         for field in Items_for_Sale.FIELDS)
+
+'''
+Every word of the query has to match, as a prefix, the item's name or
+description. On PostgreSQL the trigram index also lets a misspelt name
+match. Name matches rank above description matches.
+'''
+
+POSTGRESQL_SEARCH = text(
+    "SELECT " + ITEM_COLUMNS + " FROM sell_items, "
+    "to_tsquery('english', :tsquery) AS query "
+    "WHERE sell_items.user_id = :user_id "
+    "AND (sell_items.search_vector @@ query OR sell_items.name % :q) "
+    "ORDER BY ts_rank_cd(sell_items.search_vector, query) + "
+    "similarity(sell_items.name, :q) DESC, sell_items.id "
+    "LIMIT :limit OFFSET :offset")
+
+SQLITE_SEARCH = text(
+    "SELECT " + ITEM_COLUMNS + " FROM sell_items_fts "
+    "JOIN sell_items ON sell_items.id = sell_items_fts.rowid "
+    "WHERE sell_items_fts MATCH :match AND sell_items.user_id = :user_id "
+    "ORDER BY bm25(sell_items_fts, 10.0, 1.0), sell_items.id "
+    "LIMIT :limit OFFSET :offset")
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_SEARCH_TERMS]
+
+
+def search_items(user_id, query, limit, offset=0):
+    # Returns a page of the user's items as dicts, best match first
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    params = {'user_id': user_id, 'limit': limit, 'offset': offset}
+
+    if db.session.connection().dialect.name == 'postgresql':
+        params['tsquery'] = ' & '.join(term + ':*' for term in terms)
+        params['q'] = ' '.join(terms)
+        statement = POSTGRESQL_SEARCH
+    else:
+        params['match'] = ' '.join('"%s"*' % term for term in terms)
+        statement = SQLITE_SEARCH
+
+    result = db.session.execute(statement, params)
+
+    return [dict(zip(Items_for_Sale.FIELDS, row)) for row in result]
@@ -0,0 +1,87 @@
+"""
+JSON serialization for API responses.
+"""
+
+import json
+import os
+from datetime import date
+
+from dotenv import load_dotenv
+from flask import current_app
+from flask.json import JSONEncoder as FlaskJSONEncoder
+
+from metrics import timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+load_dotenv()
+
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'orjson' if orjson else 'json')
+
+'''
+Backends turn a response payload into UTF-8 bytes. orjson is used when it is
+installed; the standard library is the fallback. Both encode date and
+datetime values as ISO-8601 strings instead of Flask's HTTP dates.
+'''
+
+
+def encode_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+def json_dumps(value):
+    # Raw UTF-8 like orjson, so both backends emit the same bytes
+    return json.dumps(value, default=encode_default, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def orjson_dumps(value):
+    return orjson.dumps(value, default=encode_default)
+
+
+BACKENDS = {
+    'json': json_dumps
+}
+
+if orjson is not None:
+    BACKENDS['orjson'] = orjson_dumps
+
+
+def register_backend(name, dumps):
+    BACKENDS[name] = dumps
+
+
+class JSONEncoder(FlaskJSONEncoder):
+    # Keeps plain jsonify() consistent with the fast path
+    def default(self, value):
+        if isinstance(value, date):
+            return value.isoformat()
+
+        return super(JSONEncoder, self).default(value)
+
+
+def init_serializer(app, backend=None):
+    backend = backend or app.config.get('JSON_BACKEND', JSON_BACKEND)
+    if backend not in BACKENDS:
+        backend = 'json'
+
+    app.json_encoder = JSONEncoder
+    app.extensions['serializer'] = BACKENDS[backend]
+
+
+def dumps(value):
+    return current_app.extensions['serializer'](value)
+
+
+def json_response(value, status=200):
+    with timed('serialize'):
+        body = dumps(value)
+
+    return current_app.response_class(
+        body, status=status, mimetype='application/json')
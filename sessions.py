@@ -0,0 +1,142 @@
+"""
+Server-side sessions: the cookie only carries a random session id, the
+session data lives in a cache store on the server.
+"""
+
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+
+from dotenv import load_dotenv
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from cache import LRUCache, make_shared_cache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 'memory' (per worker), or 'sqlite:<path>' / 'file:<directory>' to share
+# sessions between the workers of a host
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'memory')
+SESSION_MAX_SIZE = int(os.environ.get('SESSION_MAX_SIZE', 10000))
+# Seconds a session is kept after it last changed
+SESSION_LIFETIME = int(os.environ.get('SESSION_LIFETIME', 86400))
+# Seconds between sweeps that evict expired sessions
+SESSION_PURGE_INTERVAL = int(os.environ.get('SESSION_PURGE_INTERVAL', 300))
+
+SESSION_KEY_PREFIX = 'session:'
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+'''
+ServerSideSessionInterface
+Loads and stores sessions as JSON under the session id. A session is only
+written when it changed, and an emptied session is deleted along with its
+cookie. Ids that are unknown or expired are never adopted; the client gets
+a fresh one, so a planted id cannot fix a session. Each worker process runs
+one daemon thread that evicts expired sessions every purge_interval
+seconds.
+'''
+
+
+class ServerSideSessionInterface(SessionInterface):
+    def __init__(self, store, lifetime=SESSION_LIFETIME,
+                 purge_interval=SESSION_PURGE_INTERVAL,
+                 key_prefix=SESSION_KEY_PREFIX):
+        self.store = store
+        self.lifetime = lifetime
+        self.purge_interval = purge_interval
+        self.key_prefix = key_prefix
+        self._purger_pid = None
+        self._lock = threading.Lock()
+
+    def _key(self, sid):
+        return self.key_prefix + sid
+
+    def open_session(self, app, request):
+        self.start_purger()
+
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid:
+            data = self.store.get(self._key(sid))
+            if data is not None:
+                return ServerSession(json.loads(data), sid=sid)
+
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                self.store.delete(self._key(session.sid))
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain, path=path)
+            return
+
+        if not session.modified:
+            return
+
+        self.store.set(self._key(session.sid),
+                       json.dumps(dict(session)).encode('utf-8'),
+                       expires_at=time.time() + self.lifetime)
+
+        response.set_cookie(app.session_cookie_name, session.sid,
+                            max_age=self.lifetime,
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain,
+                            path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+    def start_purger(self):
+        # Threads do not survive a fork, so every worker starts its own
+        pid = os.getpid()
+        if self._purger_pid == pid or not self.purge_interval:
+            return
+
+        with self._lock:
+            if self._purger_pid == pid:
+                return
+
+            threading.Thread(target=self._purge_forever,
+                             name='session-purger', daemon=True).start()
+            self._purger_pid = pid
+
+    def _purge_forever(self):
+        while True:
+            time.sleep(self.purge_interval)
+            try:
+                self.store.purge()
+            except Exception:
+                logger.exception('could not purge expired sessions')
+
+
+def make_session_store(spec, max_size=SESSION_MAX_SIZE,
+                       lifetime=SESSION_LIFETIME):
+    if spec == 'memory':
+        return LRUCache(max_size=max_size, ttl=lifetime)
+
+    return make_shared_cache(spec, max_size, lifetime)
+
+
+def init_sessions(app, backend=None):
+    store = make_session_store(backend or SESSION_BACKEND)
+    app.session_interface = ServerSideSessionInterface(store)
+    return store
@@ -1,15 +1,58 @@
+import gzip
+import importlib.util
+import io
 import os
 import unittest
+from unittest import mock
 import json
+import tempfile
+from datetime import date
+import sqlalchemy
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from Crypto.PublicKey import RSA
+from flask import Flask, jsonify, session
 from flask_sqlalchemy import SQLAlchemy
+from jose import jwt
+from jose.utils import base64url_encode
 from dotenv import load_dotenv
 from app import create_app
-from models import setup_db, Product, User, Items_for_Sale
+from auth import AuthError, JWKSKeyStore, requires_auth, verify_decode_jwt
+from auth import token_cache
+from cache import LRUCache, SQLiteCache, TieredCache
+from catalog import cached_page, invalidate_catalog
+from compression import init_compression
+from identity import get_or_create_user, identity_cache, resolve_user_id
+from metrics import MetricsRegistry, cache_collector, merge, read_snapshots
+from metrics import init_metrics, render, write_snapshot
+from notifications import run_reminders
+from pagination import decode_cursor, encode_cursor
+from search import search_items
+from serializers import BACKENDS, dumps, init_serializer, json_response
+from sessions import ServerSideSessionInterface
+from models import setup_db, engine_options, Product, User, Items_for_Sale
+from models import db, note_write, read_query, use_replica, wrote_recently
+from models import begin_unit_of_work, end_unit_of_work, on_commit
+from models import DataVersion, project_rows
 
 load_dotenv()
 
 ITEMS_PER_PAGE = 10
 
+TEST_JWK = {
+    'kty': 'RSA',
+    'kid': 'test-key',
+    'use': 'sig',
+    'alg': 'RS256',
+    'n': 'rgOVSIudVh2GVwiIC4BUzhoyXyol-J4WaWhzKs2nLoSxVgvXFs5WpcDsb0shjQx1'
+         'scWuMFem-iREuyU26AoE-zf_7FuxNM40DjPJuwDRsd4OsEwR0hxJ2eXXfaKKL-28'
+         'BHKybgfP4gVLYtOBMcOHTb4t7ULjgDQV5ZCiiAKkHzEKl7wyHqar0KeFjp_0RB76'
+         'saDhqRR6K-ujzQC1hDEpk3KuWATsURNnmTNJ8BJBVvNjQrP1ROFxfKZbzIutN_Dn'
+         'uiDvckj7sAAKgcHzL6xv17ajL-3t9zcItLXB9Pq86uBkLRoKcR4-jTsdHoUbwS_n'
+         '8XwPbRCttZ3oPB6AlAdL_w',
+    'e': 'AQAB'
+}
+
 auth_header_for_user_token = os.environ.get('auth_header_for_user_token')
 
 auth_header_for_user_role = {
@@ -23,6 +66,16 @@ auth_header_for_seller_role = {
 }
 
 
+def frozen_today(day):
+    # Patches date.today() as app.py sees it
+    class FrozenDate(date):
+        @classmethod
+        def today(cls):
+            return day
+
+    return mock.patch('app.date', FrozenDate)
+
+
 class WarrantyTestCase(unittest.TestCase):
     """This class represents the warranty test case"""
 
@@ -67,6 +120,41 @@ class WarrantyTestCase(unittest.TestCase):
         self.assertTrue(len(data['products']))
         self.assertTrue(data['total_products'])
 
+    def test_post_a_product_return_representation(self):
+        """Test posting a product and only getting the new product back"""
+
+        headers = dict(auth_header_for_user_role,
+                       Prefer='return=representation')
+        res = self.client().post(
+            '/products',
+            json={
+                'name': 'iPad',
+                'date_purchased': '2019-03-02',
+                'warranty_end_date': '2021-03-02'
+            }, headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['product']['name'], 'iPad')
+        self.assertNotIn('products', data)
+        self.assertEqual(res.headers['Preference-Applied'],
+                         'return=representation')
+
+    def test_post_a_product_return_minimal(self):
+        """Test posting a product with an empty 204 response"""
+
+        res = self.client().post(
+            '/products?return=minimal',
+            json={
+                'name': 'Kindle',
+                'date_purchased': '2019-03-02',
+                'warranty_end_date': '2020-03-02'
+            }, headers=auth_header_for_user_role)
+
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(res.data, b'')
+
     def test_422_cannot_post_product(self):
         """Test 422 error for post request with no request data"""
 
@@ -78,6 +166,44 @@ class WarrantyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'cannot process request')
 
+    def test_bulk_import_products(self):
+        """Test importing products from a CSV upload"""
+
+        csv_body = (
+            'name,date_purchased,warranty_end_date\n'
+            'Dishwasher,2019-06-01,2024-06-01\n'
+            'Blender,2019-07-15,2021-07-15\n')
+        res = self.client().post(
+            '/products/bulk',
+            data=csv_body,
+            content_type='text/csv',
+            headers=auth_header_for_user_role)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_products'], 2)
+
+    def test_422_bulk_import_reports_row_errors(self):
+        """Test a bulk import with an invalid row inserts nothing"""
+
+        res = self.client().post(
+            '/products/bulk',
+            json=[
+                {
+                    'name': 'Toaster',
+                    'date_purchased': '2019-01-01',
+                    'warranty_end_date': '2020-01-01'
+                },
+                {'name': 'Kettle', 'date_purchased': 'yesterday'}
+            ], headers=auth_header_for_user_role)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['errors'][0]['row'], 2)
+        self.assertIn('warranty_end_date', data['errors'][0]['errors'])
+
     def test_retrieve_products(self):
         """Test get request for listing out all products"""
 
@@ -100,6 +226,244 @@ class WarrantyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'request not found')
 
+    def test_retrieve_products_page_by_page(self):
+        """Test pages are consecutive slices that end in a 404"""
+
+        self.client().post('/products/bulk', json=[{
+            'name': 'Charger %d' % i,
+            'date_purchased': '2019-03-02',
+            'warranty_end_date': '2021-03-02'
+        } for i in range(ITEMS_PER_PAGE + 1)],
+            headers=auth_header_for_user_role)
+
+        ids = []
+        page = 1
+        while True:
+            res = self.client().get('/products?page=%d' % page,
+                                    headers=auth_header_for_user_role)
+            if res.status_code == 404:
+                break
+            products = json.loads(res.data)['products']
+            self.assertLessEqual(len(products), ITEMS_PER_PAGE)
+            ids += [product['id'] for product in products]
+            page += 1
+
+        self.assertGreater(page, 2)
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual(json.loads(res.data)['success'], False)
+
+    def test_404_invalid_products_page(self):
+        """Test 404 for a page below 1 or a page that is not an integer"""
+
+        for page in ('0', '-1', 'two', '1.5'):
+            res = self.client().get('/products?page=' + page,
+                                    headers=auth_header_for_user_role)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 404)
+            self.assertEqual(data['success'], False)
+            self.assertEqual(data['message'], 'request not found')
+
+    def test_retrieve_products_with_cursor(self):
+        """Test keyset pagination over products"""
+
+        for name in ('Camera', 'Phone'):
+            self.client().post(
+                '/products?return=minimal',
+                json={
+                    'name': name,
+                    'date_purchased': '2019-03-02',
+                    'warranty_end_date': '2021-03-02'
+                }, headers=auth_header_for_user_role)
+
+        res = self.client().get('/products?limit=1',
+                                headers=auth_header_for_user_role)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['products']), 1)
+        self.assertIsNotNone(data['next_cursor'])
+
+        res = self.client().get(
+            '/products?limit=1&after=' + data['next_cursor'],
+            headers=auth_header_for_user_role)
+        next_page = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(next_page['products']), 1)
+        self.assertGreater(next_page['products'][0]['id'],
+                           data['products'][0]['id'])
+
+    def test_400_invalid_products_cursor(self):
+        """Test 400 error for a cursor the server did not issue"""
+
+        res = self.client().get('/products?after=not-a-cursor',
+                                headers=auth_header_for_user_role)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request, try again')
+
+    def test_export_products_as_ndjson(self):
+        """Test streaming all products as NDJSON"""
+
+        res = self.client().get('/products/export?format=ndjson',
+                                headers=auth_header_for_user_role)
+        lines = res.data.decode('utf-8').splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertTrue(lines)
+        self.assertIn('warranty_end_date', json.loads(lines[0]))
+
+    def test_400_cannot_export_unknown_format(self):
+        """Test 400 error for an unsupported export format"""
+
+        res = self.client().get('/products/export?format=xlsx',
+                                headers=auth_header_for_user_role)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_retrieve_expiring_products(self):
+        """Test listing products whose warranty ends within a period"""
+
+        res = self.client().get('/products/expiring?within=52w',
+                                headers=auth_header_for_user_role)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        end_dates = [product['warranty_end_date']
+                     for product in data['products']]
+        self.assertEqual(end_dates, sorted(end_dates))
+
+    def test_400_cannot_retrieve_expiring_products(self):
+        """Test 400 error for an unreadable expiry window"""
+
+        res = self.client().get('/products/expiring?within=soon',
+                                headers=auth_header_for_user_role)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_retrieve_products_with_fields(self):
+        """Test listing only the requested product fields"""
+
+        res = self.client().get('/products?fields=id,name',
+                                headers=auth_header_for_user_role)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(set(data['products'][0].keys()), {'id', 'name'})
+
+    def test_retrieve_products_not_modified(self):
+        """Test an unchanged product listing is answered with 304"""
+
+        res = self.client().get('/products',
+                                headers=auth_header_for_user_role)
+        headers = dict(auth_header_for_user_role,
+                       **{'If-None-Match': res.headers['ETag']})
+        res = self.client().get('/products', headers=headers)
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    def test_retrieve_products_from_response_cache(self):
+        """Test a repeated listing is served from the response cache"""
+
+        self.client().get('/products', headers=auth_header_for_user_role)
+        res = self.client().get('/products',
+                                headers=auth_header_for_user_role)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['X-Cache'], 'HIT')
+        self.assertEqual(data['success'], True)
+
+    def test_write_changes_products_etag(self):
+        """Test creating a product invalidates the listing's ETag"""
+
+        res = self.client().get('/products',
+                                headers=auth_header_for_user_role)
+        etag = res.headers['ETag']
+
+        self.client().post(
+            '/products?return=minimal',
+            json={
+                'name': 'Camera',
+                'date_purchased': '2019-03-02',
+                'warranty_end_date': '2021-03-02'
+            }, headers=auth_header_for_user_role)
+        res = self.client().get('/products', headers=dict(
+            auth_header_for_user_role, **{'If-None-Match': etag}))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_expiring_products_etag_changes_daily(self):
+        """Test an expiry listing is not answered with 304 the next day"""
+
+        with frozen_today(date(2026, 10, 18)):
+            res = self.client().get('/products/expiring',
+                                    headers=auth_header_for_user_role)
+            headers = dict(auth_header_for_user_role,
+                           **{'If-None-Match': res.headers['ETag']})
+            self.assertEqual(self.client().get(
+                '/products/expiring', headers=headers).status_code, 304)
+
+        with frozen_today(date(2026, 10, 19)):
+            res = self.client().get('/products/expiring', headers=headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], headers['If-None-Match'])
+
+    def test_expiring_products_cache_is_daily(self):
+        """Test the previous day's expiry listing is not served from cache"""
+
+        with frozen_today(date(2026, 10, 18)):
+            self.client().get('/products/expiring?within=4w',
+                              headers=auth_header_for_user_role)
+            res = self.client().get('/products/expiring?within=4w',
+                                    headers=auth_header_for_user_role)
+            self.assertEqual(res.headers['X-Cache'], 'HIT')
+
+        with frozen_today(date(2026, 10, 19)):
+            res = self.client().get('/products/expiring?within=4w',
+                                    headers=auth_header_for_user_role)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+
+    def test_write_does_not_start_a_session(self):
+        """Test token-authenticated writes do not create sessions"""
+
+        res = self.client().post(
+            '/products?return=minimal',
+            json={
+                'name': 'Camera',
+                'date_purchased': '2019-03-02',
+                'warranty_end_date': '2021-03-02'
+            }, headers=auth_header_for_user_role)
+
+        self.assertLess(res.status_code, 400)
+        self.assertNotIn('Set-Cookie', res.headers)
+
+    def test_400_cannot_retrieve_unknown_fields(self):
+        """Test 400 error for a field that does not exist"""
+
+        res = self.client().get('/products?fields=id,password',
+                                headers=auth_header_for_user_role)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     def test_update_products(self):
         """Test update request for a product"""
 
@@ -115,6 +479,34 @@ class WarrantyTestCase(unittest.TestCase):
         self.assertTrue(data['products'])
         self.assertTrue(data['total_products'])
 
+    def test_bulk_update_products(self):
+        """Test extending the warranty of products selected by a filter"""
+
+        res = self.client().patch(
+            '/products',
+            headers=auth_header_for_user_role,
+            json={
+                'filter': {'name': 'MacBook'},
+                'set': {'warranty_end_date': '2027-01-12'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIn('updated_products', data)
+
+    def test_422_bulk_update_without_selection(self):
+        """Test 422 error for a bulk update with no ids or filter"""
+
+        res = self.client().patch(
+            '/products',
+            headers=auth_header_for_user_role,
+            json={'set': {'name': 'Everything'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'cannot process request')
+
     def test_422_cannot_update_product(self):
         """Test 422 error for get request to page that does not exist"""
 
@@ -191,6 +583,41 @@ class WarrantyTestCase(unittest.TestCase):
         self.assertTrue(data['items'])
         self.assertTrue(data['total_items'])
 
+    def test_retrieve_items_with_cursor(self):
+        """Test keyset pagination over items"""
+
+        res = self.client().get('/items?limit=1',
+                                headers=auth_header_for_seller_role)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['items']), 1)
+        self.assertIn('next_cursor', data)
+
+    def test_search_items(self):
+        """Test searching the seller's items"""
+
+        res = self.client().get('/items/search?q=phone',
+                                headers=auth_header_for_seller_role)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIn('items', data)
+        self.assertEqual(data['total_items'], len(data['items']))
+
+    def test_400_cannot_search_without_query(self):
+        """Test 400 error for a search without a query"""
+
+        res = self.client().get('/items/search?q=',
+                                headers=auth_header_for_seller_role)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request, try again')
+
     def test_404_cannot_retrieve_items(self):
         """Test 404 error for get request to page that does not exist"""
 
@@ -213,6 +640,18 @@ class WarrantyTestCase(unittest.TestCase):
         self.assertEqual(data['total_items'])
     """
 
+    def test_bulk_delete_items(self):
+        """Test deleting items selected by ids"""
+
+        res = self.client().delete('/items',
+                                   json={'ids': [10000, 10001]},
+                                   headers=auth_header_for_seller_role)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['deleted_items'], 0)
+
     def test_404_cannot_delete_item(self):
         """Test 404 error for an invalid item ID for deleting
            product"""
@@ -225,6 +664,31 @@ class WarrantyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'request not found')
 
+    def test_retrieve_catalog(self):
+        """Test the public catalog is cacheable and revalidates to 304"""
+
+        res = self.client().get('/catalog')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIn('next_cursor', data)
+        self.assertIn('public', res.headers['Cache-Control'])
+
+        res = self.client().get('/catalog', headers={
+            'If-None-Match': res.headers['ETag']})
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_400_cannot_retrieve_catalog_with_invalid_cursor(self):
+        """Test 400 error for a catalog cursor we did not issue"""
+
+        res = self.client().get('/catalog?after=not-a-cursor')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     def test_get_a_product_unauthorized(self):
         """Test retrieving a product but as a seller role"""
 
@@ -309,6 +773,1011 @@ class WarrantyTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 403)
         self.assertEqual(data['success'], False)
 
+    def test_get_metrics(self):
+        """Test request latencies are reported in the Prometheus format"""
+
+        self.client().get('/catalog')
+        res = self.client().get('/metrics')
+        data = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('http_request_duration_seconds_count{'
+                      'endpoint="/catalog",method="GET",status="200"} 1',
+                      data)
+        self.assertIn('cache_misses_total{cache="catalog"}', data)
+
+    def test_metrics_label_unmatched_urls(self):
+        """Test unknown URLs are reported under one label"""
+
+        self.client().get('/no-such-page')
+        data = self.client().get('/metrics').data.decode()
+
+        self.assertIn('endpoint="unmatched",method="GET",status="404"', data)
+        self.assertNotIn('no-such-page', data)
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    """This class tests the cached JWKS key store against a local file"""
+
+    def setUp(self):
+        self.jwks_file = tempfile.NamedTemporaryFile(
+            mode='w', suffix='.json', delete=False)
+        json.dump({'keys': [TEST_JWK]}, self.jwks_file)
+        self.jwks_file.close()
+        self.store = JWKSKeyStore(
+            jwks_url='file://' + self.jwks_file.name,
+            ttl=600,
+            min_refresh_interval=600)
+
+    def tearDown(self):
+        os.remove(self.jwks_file.name)
+
+    def test_key_is_parsed_once_and_reused(self):
+        """Test the JWKS document is only read on the first lookup"""
+
+        key = self.store.get_key('test-key')
+        self.assertIsNotNone(key)
+
+        os.remove(self.jwks_file.name)
+        open(self.jwks_file.name, 'w').close()
+
+        self.assertIs(self.store.get_key('test-key'), key)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        """Test unknown kids do not refetch inside the refresh interval"""
+
+        self.assertIsNotNone(self.store.get_key('test-key'))
+
+        rotated = dict(TEST_JWK, kid='rotated-key')
+        with open(self.jwks_file.name, 'w') as jwks_file:
+            json.dump({'keys': [rotated]}, jwks_file)
+
+        self.assertIsNone(self.store.get_key('rotated-key'))
+
+        self.store.min_refresh_interval = 0
+        self.assertIsNotNone(self.store.get_key('rotated-key'))
+
+
+def jwk_uint(value):
+    # Base64url of a big-endian unsigned integer, as JWKs encode n and e
+    return base64url_encode(
+        value.to_bytes((value.bit_length() + 7) // 8, 'big')).decode()
+
+
+class TokenVerificationTestCase(unittest.TestCase):
+    """This class tests verifying tokens signed by a key from the JWKS"""
+
+    @classmethod
+    def setUpClass(cls):
+        key = RSA.generate(2048)
+        cls.private_key = key.exportKey('PEM').decode()
+        cls.jwks_file = tempfile.NamedTemporaryFile(
+            mode='w', suffix='.json', delete=False)
+        json.dump({'keys': [{
+            'kty': 'RSA',
+            'kid': 'signing-key',
+            'use': 'sig',
+            'alg': 'RS256',
+            'n': jwk_uint(key.n),
+            'e': jwk_uint(key.e)
+        }]}, cls.jwks_file)
+        cls.jwks_file.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.jwks_file.name)
+
+    def setUp(self):
+        store = JWKSKeyStore(jwks_url='file://' + self.jwks_file.name)
+        patches = [
+            mock.patch('auth.jwks_store', store),
+            mock.patch.multiple('auth', ALGORITHMS='RS256',
+                                API_AUDIENCE='warranty',
+                                AUTH0_DOMAIN='tenant.auth0.com'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        token_cache.clear()
+
+        self.app = Flask(__name__)
+
+        @self.app.route('/products')
+        @requires_auth('get:products')
+        def products():
+            return jsonify({'success': True})
+
+        @self.app.errorhandler(AuthError)
+        def auth_error(error):
+            return jsonify(error.error), error.status_code
+
+    def sign(self, permissions=('get:products',), kid='signing-key'):
+        return jwt.encode({
+            'sub': 'auth0|user',
+            'aud': 'warranty',
+            'iss': 'https://tenant.auth0.com/',
+            'permissions': list(permissions)
+        }, self.private_key, algorithm='RS256', headers={'kid': kid})
+
+    def get(self, token):
+        return self.app.test_client().get(
+            '/products', headers={'Authorization': 'Bearer ' + token})
+
+    def test_signed_token_is_verified(self):
+        """Test a token signed by a key in the JWKS decodes to its claims"""
+
+        payload = verify_decode_jwt(self.sign())
+
+        self.assertEqual(payload['sub'], 'auth0|user')
+        self.assertEqual(payload['permissions'], ['get:products'])
+
+    def test_requires_auth_accepts_signed_token(self):
+        """Test requires_auth lets a validly signed token through"""
+
+        res = self.get(self.sign())
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['success'], True)
+
+    def test_requires_auth_rejects_bad_tokens(self):
+        """Test a forged payload, an unknown kid and a missing permission"""
+
+        header, payload, signature = self.sign(()).split('.')
+        forged = '.'.join([header, self.sign().split('.')[1], signature])
+
+        self.assertEqual(self.get(forged).status_code, 400)
+        self.assertEqual(self.get(self.sign(kid='other-key')).status_code,
+                         400)
+        self.assertEqual(self.get(self.sign(())).status_code, 401)
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    """This class tests the bounded cache used for verified tokens"""
+
+    def test_evicts_least_recently_used(self):
+        """Test the cache never grows past its maximum size"""
+
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_expired_entries_are_misses(self):
+        """Test entries are dropped once their expiry has passed"""
+
+        cache = LRUCache(max_size=2)
+        cache.set('token', {'sub': 'user'}, expires_at=0)
+
+        self.assertIsNone(cache.get('token'))
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['hits'], 0)
+
+
+class TieredCacheTestCase(unittest.TestCase):
+    """This class tests the response cache tiers"""
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+
+    def test_shared_tier_serves_other_workers(self):
+        """Test an entry written by one worker is found by another"""
+
+        TieredCache(LRUCache(), SQLiteCache(self.path)).set('key', b'body')
+        cache = TieredCache(LRUCache(), SQLiteCache(self.path))
+
+        self.assertEqual(cache.get('key'), b'body')
+        self.assertEqual(cache.local.get('key'), b'body')
+        self.assertEqual(cache.stats()['hit_ratio'], 1.0)
+
+    def test_shared_tier_is_bounded(self):
+        """Test the SQLite tier trims itself back to its maximum size"""
+
+        cache = SQLiteCache(self.path, max_size=2, ttl=60)
+        for i in range(5):
+            cache.set('key%d' % i, b'body')
+        cache.purge()
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('key0'))
+
+
+class ServerSessionTestCase(unittest.TestCase):
+    """This class tests the server-side session store"""
+
+    def setUp(self):
+        self.store = LRUCache(max_size=10, ttl=60)
+        self.app = Flask(__name__)
+        self.app.secret_key = 'test'
+        self.app.session_interface = ServerSideSessionInterface(
+            self.store, lifetime=60, purge_interval=0)
+
+        @self.app.route('/login')
+        def login():
+            session['email'] = 'a@example.com'
+            return 'ok'
+
+        @self.app.route('/whoami')
+        def whoami():
+            return session.get('email', '')
+
+        @self.app.route('/logout')
+        def logout():
+            session.clear()
+            return 'ok'
+
+    def test_cookie_only_carries_the_id(self):
+        """Test session data is kept on the server, keyed by the cookie"""
+
+        client = self.app.test_client()
+        res = client.get('/login')
+        cookie = res.headers['Set-Cookie']
+
+        self.assertNotIn('example.com', cookie)
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(client.get('/whoami').data, b'a@example.com')
+
+        client.get('/logout')
+        self.assertEqual(len(self.store), 0)
+        self.assertEqual(client.get('/whoami').data, b'')
+
+    def test_unknown_ids_are_not_adopted(self):
+        """Test expired or made up ids start a fresh, empty session"""
+
+        client = self.app.test_client()
+        client.set_cookie('localhost', 'session', 'planted')
+
+        self.assertEqual(client.get('/whoami').data, b'')
+        client.get('/login')
+        self.assertIsNone(self.store.get('session:planted'))
+
+        self.store.set('session:old', b'{"email": "old"}', expires_at=0)
+        self.store.purge()
+        self.assertEqual(self.store.stats()['expirations'], 1)
+
+
+class MetricsTestCase(unittest.TestCase):
+    """This class tests the aggregation of worker metrics"""
+
+    def snapshot(self, pid, latency, started=1.0):
+        registry = MetricsRegistry()
+        registry.observe('http_request_duration_seconds',
+                         (('endpoint', '/products'),), latency)
+        registry.add_collector(lambda: [
+            ('gauge', 'db_pool_checked_out', (('engine', 'primary'),), 2),
+            ('counter', 'cache_hits_total', (('cache', 'token'),), 3),
+            ('shared', 'cache_size', (('cache', 'session'),), 5)])
+
+        snapshot = registry.snapshot()
+        snapshot['pid'] = pid
+        snapshot['started'] = started
+        return json.loads(json.dumps(snapshot))
+
+    def test_workers_are_added_up(self):
+        """Test histograms and counters are summed over the workers"""
+
+        histograms, samples = merge([self.snapshot(os.getpid(), 0.003),
+                                     self.snapshot(os.getppid(), 0.2)])
+        data = render(histograms, samples)
+
+        self.assertIn('http_request_duration_seconds_bucket{'
+                      'endpoint="/products",le="0.005"} 1', data)
+        self.assertIn('http_request_duration_seconds_count{'
+                      'endpoint="/products"} 2', data)
+        self.assertIn('cache_hits_total{cache="token"} 6', data)
+        self.assertIn('cache_hit_ratio{cache="token"} 1.0', data)
+        self.assertIn('db_pool_checked_out{engine="primary"} 4', data)
+        self.assertIn('cache_size{cache="session"} 5', data)
+
+    def test_shared_store_is_counted_once_in_a_while(self):
+        """Test the size of a shared store is not a query per snapshot"""
+
+        store = SQLiteCache(os.path.join(tempfile.mkdtemp(), 'cache.db'))
+        store.set('session:a', b'{}')
+        collect = cache_collector('session', store, size_interval=60)
+
+        self.assertIn(('shared', 'cache_size', (('cache', 'session'),), 1),
+                      collect())
+        store.set('session:b', b'{}')
+        self.assertIn(('shared', 'cache_size', (('cache', 'session'),), 1),
+                      collect())
+
+    def test_exited_workers_only_keep_counters(self):
+        """Test gauges of workers that have exited are left out"""
+
+        directory = tempfile.mkdtemp()
+        write_snapshot(directory, self.snapshot(2 ** 22 + 1, 0.003))
+        histograms, samples = merge(read_snapshots(directory))
+        data = render(histograms, samples)
+
+        self.assertIn('cache_hits_total{cache="token"} 3', data)
+        self.assertNotIn('db_pool_checked_out', data)
+
+    def test_recycled_pid_does_not_replace_exited_worker(self):
+        """Test a worker reusing a pid keeps the old worker's counters"""
+
+        directory = tempfile.mkdtemp()
+        write_snapshot(directory, self.snapshot(os.getpid(), 0.003, 1.0))
+        write_snapshot(directory, self.snapshot(os.getpid(), 0.003, 2.0))
+        histograms, samples = merge(read_snapshots(directory))
+        data = render(histograms, samples)
+
+        self.assertIn('cache_hits_total{cache="token"} 6', data)
+        self.assertIn('db_pool_checked_out{engine="primary"} 2', data)
+
+    def test_tiered_cache_with_shared_tier_is_collected(self):
+        """Test a TieredCache reports its local size and its shared tier"""
+
+        directory = tempfile.mkdtemp()
+        cache = TieredCache(LRUCache(), SQLiteCache(
+            os.path.join(directory, 'cache.db')))
+        cache.set('a', b'1')
+        cache.set('b', b'2')
+        cache.local.clear()
+
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        init_metrics(app, SQLAlchemy(app), caches={'response': cache},
+                     directory=os.path.join(directory, 'metrics'))
+
+        @app.route('/ping')
+        def ping():
+            return 'pong'
+
+        self.assertEqual(app.test_client().get('/ping').status_code, 200)
+        res = app.test_client().get('/metrics')
+        data = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('cache_size{cache="response"} 0', data)
+        self.assertIn('cache_size{cache="response",tier="shared"} 2', data)
+
+    def test_failed_flush_does_not_fail_the_request(self):
+        """Test an unwritable METRICS_DIR only costs the snapshot"""
+
+        directory = tempfile.mkdtemp()
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        init_metrics(app, SQLAlchemy(app), directory=directory)
+
+        @app.route('/ping')
+        def ping():
+            return 'pong'
+
+        os.rmdir(directory)
+        with self.assertLogs('metrics', 'ERROR'):
+            res = app.test_client().get('/ping')
+        self.assertEqual(res.status_code, 200)
+
+        with self.assertLogs('metrics', 'ERROR'):
+            res = app.test_client().get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('endpoint="/ping"', res.data.decode())
+
+
+class SerializerTestCase(unittest.TestCase):
+    """This class tests the JSON backends"""
+
+    def setUp(self):
+        self.product = Product('Café table', date(2020, 5, 12),
+                               date(2022, 5, 12), 1)
+        self.product.id = 3
+
+    def encode(self, backend, value):
+        app = Flask(__name__)
+        init_serializer(app, backend)
+        with app.app_context():
+            return dumps(value)
+
+    def test_dates_are_iso_8601(self):
+        """Test every backend encodes dates as ISO-8601 strings"""
+
+        for backend in BACKENDS:
+            self.assertEqual(self.encode(backend, {'day': date(2020, 5, 12)}),
+                             b'{"day":"2020-05-12"}')
+
+    @unittest.skipUnless('orjson' in BACKENDS, 'orjson is not installed')
+    def test_backends_agree(self):
+        """Test json and orjson encode a product to the same bytes"""
+
+        self.assertEqual(self.encode('json', self.product.format()),
+                         self.encode('orjson', self.product.format()))
+
+    def test_unknown_backend_falls_back_to_json(self):
+        """Test an unknown JSON_BACKEND uses the standard library"""
+
+        app = Flask(__name__)
+        init_serializer(app, 'simplejson')
+        self.assertIs(app.extensions['serializer'], BACKENDS['json'])
+
+        with app.app_context():
+            res = json_response({'success': False}, 404)
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res.mimetype, 'application/json')
+        self.assertEqual(res.get_data(), b'{"success":false}')
+
+
+class CursorTestCase(unittest.TestCase):
+    """This class tests encoding and decoding of page cursors"""
+
+    columns = [Product.warranty_end_date, Product.id]
+
+    def test_round_trip(self):
+        """Test a cursor decodes to the values it was made from"""
+
+        cursor = encode_cursor([date(2021, 3, 2), 7])
+
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor, self.columns),
+                         [date(2021, 3, 2), 7])
+
+    def test_tampered_cursors_are_rejected(self):
+        """Test values of the wrong type or shape raise ValueError"""
+
+        for values in ([20210302, 7], ['2021-03-02', '7'],
+                       ['2021-03-02', True], ['2021-03-02'],
+                       ['2021-13-02', 7]):
+            cursor = encode_cursor(values)
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor, self.columns)
+
+        # The last one is '{"id":7}', an object instead of a list
+        for cursor in ('not-a-cursor', '%%%', encode_cursor([7]) + 'x',
+                       'eyJpZCI6N30'):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor, [Product.id])
+
+
+class CompressionTestCase(unittest.TestCase):
+    """This class tests negotiated response compression"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        init_compression(self.app, min_size=100)
+        self.body = json.dumps([{'user_id': 1}] * 100)
+
+        @self.app.route('/page')
+        def page():
+            return self.app.response_class(self.body,
+                                           mimetype='application/json')
+
+        @self.app.route('/export')
+        def export():
+            lines = (line + '\n' for line in self.body.split(','))
+            return self.app.response_class(lines, mimetype='text/csv')
+
+    def test_gzip_is_negotiated(self):
+        """Test gzip responses decode to the original body"""
+
+        res = self.app.test_client().get(
+            '/page', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(gzip.decompress(res.data).decode(), self.body)
+
+        res = self.app.test_client().get('/page')
+        self.assertNotIn('Content-Encoding', res.headers)
+
+    def test_streamed_responses_are_compressed(self):
+        """Test generator responses are compressed as they stream"""
+
+        res = self.app.test_client().get(
+            '/export', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', res.headers)
+        self.assertEqual(gzip.decompress(res.data).decode().count('\n'),
+                         len(self.body.split(',')))
+
+
+class ReminderSchedulerTestCase(unittest.TestCase):
+    """This class tests the incremental expiry reminder scheduler"""
+
+    def setUp(self):
+        self.app = create_app()
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+    def test_repeat_runs_do_not_resend(self):
+        """Test a second run queues and delivers nothing new"""
+
+        with self.app.app_context():
+            run_reminders(days=30, sink=self)
+            stats = run_reminders(days=30, sink=self)
+
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['sent'], 0)
+
+
+class ReminderChangesTestCase(unittest.TestCase):
+    """This class tests reminders for products whose end date changes"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        setup_db(self.app, 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'warranty.db'), [])
+        self.today = date(2020, 1, 1)
+        self.sent = []
+
+        with self.app.app_context():
+            user = User('A', 'a@example.com')
+            user.insert()
+            for name, end in (('Laptop', date(2030, 1, 1)),
+                              ('Phone', date(2030, 1, 1)),
+                              ('Camera', date(2020, 1, 20))):
+                Product(name, None, end, user.id).insert()
+
+    def send(self, message):
+        self.sent.append(message)
+
+    def run_reminders(self, sink=None):
+        return run_reminders(days=30, sink=sink or self, today=self.today)
+
+    def test_end_date_moved_behind_the_mark_is_reminded(self):
+        """Test edited and bulk-updated products still get a reminder"""
+
+        with self.app.app_context():
+            self.assertEqual(self.run_reminders()['queued'], 1)
+
+            laptop = Product.query.filter_by(name='Laptop').one()
+            laptop.warranty_end_date = date(2020, 1, 10)
+            laptop.update()
+            Product.update_where([Product.name == 'Phone'],
+                                 {'warranty_end_date': date(2020, 1, 5)})
+
+            stats = self.run_reminders()
+
+        self.assertEqual(stats['queued'], 2)
+        self.assertEqual(stats['sent'], 2)
+        self.assertEqual(
+            sorted(message['subject'] for message in self.sent[1:]),
+            ['The warranty for Laptop ends on 2020-01-10',
+             'The warranty for Phone ends on 2020-01-05'])
+
+    def test_reminder_for_an_old_end_date_is_not_sent(self):
+        """Test a queued reminder is dropped once the end date changes"""
+
+        class FailingSink:
+            def send(self, message):
+                raise OSError('sink is down')
+
+        with self.app.app_context():
+            with self.assertLogs('notifications', 'ERROR'):
+                self.run_reminders(FailingSink())
+
+            camera = Product.query.filter_by(name='Camera').one()
+            camera.warranty_end_date = date(2030, 1, 1)
+            camera.update()
+
+            stats = self.run_reminders()
+
+        self.assertEqual(stats['sent'], 0)
+        self.assertEqual(self.sent, [])
+
+
+class CatalogCacheTestCase(unittest.TestCase):
+    """This class tests the catalog cache shared by the workers"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        setup_db(self.app, 'sqlite:///' + os.path.join(
+            self.directory, 'warranty.db'), [])
+        self.builds = 0
+
+    def worker(self, shared=True):
+        # Every worker has its own LRU in front of the host's shared tier
+        tier = SQLiteCache(os.path.join(self.directory, 'cache.db'))
+        return TieredCache(LRUCache(), tier if shared else None)
+
+    def page(self, cache):
+        def build():
+            self.builds += 1
+            return b'page %d' % self.builds
+
+        with mock.patch('catalog.catalog_cache', cache):
+            return cached_page((None, 10), build)
+
+    def test_shared_tier_serves_other_workers(self):
+        """Test a page encoded by one worker is served by another"""
+
+        with self.app.app_context():
+            self.assertEqual(self.page(self.worker()),
+                             self.page(self.worker()))
+
+        self.assertEqual(self.builds, 1)
+
+    def test_committed_write_retires_pages_of_every_worker(self):
+        """Test invalidation reaches workers that did not handle the write"""
+
+        other = self.worker(shared=False)
+
+        with self.app.app_context():
+            body, etag = self.page(other)
+
+            begin_unit_of_work()
+            on_commit(invalidate_catalog)
+            end_unit_of_work(commit=False)
+            self.assertEqual(self.page(other), (body, etag))
+
+            begin_unit_of_work()
+            on_commit(invalidate_catalog)
+            end_unit_of_work()
+            invalidate_catalog()
+
+            self.assertEqual(DataVersion.current('catalog'), 2)
+            self.assertNotEqual(self.page(other), (body, etag))
+
+
+class EngineOptionsTestCase(unittest.TestCase):
+    """This class tests the connection pool profiles"""
+
+    def test_default_profile_recovers_from_failover(self):
+        """Test pooled connections are pinged, recycled and time limited"""
+
+        options = engine_options('postgresql://localhost/warranty')
+
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertIn('pool_recycle', options)
+        self.assertIn('statement_timeout',
+                      options['connect_args']['options'])
+
+    def test_pgbouncer_profile_leaves_pooling_to_pgbouncer(self):
+        """Test the pgbouncer profile sends no startup parameters"""
+
+        options = engine_options('postgresql://localhost:6432/warranty',
+                                 profile='pgbouncer')
+
+        self.assertNotIn('connect_args', options)
+        self.assertNotIn('pool_size', options)
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """This class tests read replica routing with two SQLite databases"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        setup_db(self.app, self.path('primary.db'), [self.path('replica.db')])
+
+        with self.app.app_context():
+            db.Model.metadata.create_all(
+                db.get_engine(self.app, bind='replica_0'))
+
+    def path(self, name):
+        return 'sqlite:///' + os.path.join(self.directory, name)
+
+    def test_pinned_reads_use_the_replica(self):
+        """Test reads go to the replica once the session is pinned"""
+
+        with self.app.app_context():
+            Product('Laptop', date(2020, 1, 1), date(2022, 1, 1),
+                    None).insert()
+            db.session.remove()
+
+            use_replica()
+            self.assertEqual(read_query(Product).all(), [])
+
+    def test_writes_stay_on_the_primary(self):
+        """Test a pinned session still writes to the primary"""
+
+        with self.app.app_context():
+            use_replica()
+            Product('Laptop', date(2020, 1, 1), date(2022, 1, 1),
+                    None).insert()
+            db.session.remove()
+
+            self.assertEqual(len(read_query(Product).all()), 1)
+
+    def test_recent_writes_are_seen_by_other_workers(self):
+        """Test a write noted by one worker keeps another on the primary"""
+
+        path = os.path.join(self.directory, 'writers.db')
+        writers = TieredCache(LRUCache(ttl=5), SQLiteCache(path, ttl=5))
+
+        with mock.patch('models.recent_writers', writers):
+            note_write(1)
+            # Another worker: its own LRU, the same shared tier
+            writers.local = LRUCache(ttl=5)
+
+            self.assertTrue(wrote_recently(1))
+            self.assertFalse(wrote_recently(2))
+
+
+class SearchTestCase(unittest.TestCase):
+    """This class tests item search on the SQLite FTS5 fallback"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        setup_db(self.app, 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'warranty.db'), [])
+
+        with self.app.app_context():
+            seller = User('Seller', 'seller@example.com')
+            other = User('Other', 'other@example.com')
+            seller.insert()
+            other.insert()
+            self.seller_id = seller.id
+
+            for name, description, user_id in (
+                    ('Printer', 'Laser printer for the office', seller.id),
+                    ('Desk', 'Fits a laptop and a printer', seller.id),
+                    ('Laptop', 'Light laptop with a long warranty',
+                     seller.id),
+                    ('Laptop', 'Not for sale by this seller', other.id)):
+                Items_for_Sale(name, 12, description, 'link.com',
+                               user_id).insert()
+
+    def test_prefixes_match_the_sellers_items(self):
+        """Test every word matches as a prefix, only in own items"""
+
+        with self.app.app_context():
+            items = search_items(self.seller_id, 'lapt', 10)
+            self.assertEqual([item['name'] for item in items],
+                             ['Laptop', 'Desk'])
+            items = search_items(self.seller_id, 'print off', 10)
+            self.assertEqual([item['name'] for item in items], ['Printer'])
+            self.assertEqual(search_items(self.seller_id, 'laptop off', 10),
+                             [])
+
+    def test_name_matches_rank_first(self):
+        """Test an item named after the query ranks above mentions"""
+
+        with self.app.app_context():
+            items = search_items(self.seller_id, 'printer', 10)
+            self.assertEqual([item['name'] for item in items],
+                             ['Printer', 'Desk'])
+
+            items = search_items(self.seller_id, 'printer', 1, offset=1)
+            self.assertEqual([item['name'] for item in items], ['Desk'])
+
+
+class IdentityTestCase(unittest.TestCase):
+    """This class tests resolving Auth0 subjects to local users"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        setup_db(self.app, 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'warranty.db'), [])
+        identity_cache.clear()
+
+    def test_existing_email_is_linked(self):
+        """Test a new subject is linked to the account with its email"""
+
+        with self.app.app_context():
+            User('A', 'a@example.com').insert()
+            user = get_or_create_user({
+                'name': 'A', 'email': 'a@example.com', 'sub': 'auth0|a'})
+
+            self.assertEqual(User.query.count(), 1)
+            self.assertEqual(user.auth0_sub, 'auth0|a')
+
+    def test_changed_email_keeps_the_account(self):
+        """Test a subject whose email changed resolves to its account"""
+
+        with self.app.app_context():
+            User('A', 'old@example.com', 'auth0|a').insert()
+            User('B', 'b@example.com', 'auth0|b').insert()
+
+            user = get_or_create_user({
+                'name': 'A', 'email': 'new@example.com', 'sub': 'auth0|a'})
+            self.assertEqual(user.auth0_sub, 'auth0|a')
+            self.assertEqual(user.email, 'new@example.com')
+
+            # Taken by another account: the old email is kept
+            user = get_or_create_user({
+                'name': 'A', 'email': 'b@example.com', 'sub': 'auth0|a'})
+            self.assertEqual(user.auth0_sub, 'auth0|a')
+            self.assertEqual(user.email, 'new@example.com')
+            self.assertEqual(User.query.count(), 2)
+
+    def test_first_sighting_calls_userinfo_once(self):
+        """Test only an unknown subject calls /userinfo and is created"""
+
+        userinfo = {'name': 'A', 'email': 'a@example.com', 'sub': 'auth0|a'}
+
+        with self.app.app_context(), mock.patch(
+                'identity.fetch_userinfo', return_value=userinfo) as fetch:
+            user_id = resolve_user_id({'sub': 'auth0|a'}, 'Bearer token')
+            self.assertEqual(fetch.call_count, 1)
+            self.assertEqual(User.query.get(user_id).auth0_sub, 'auth0|a')
+
+            identity_cache.clear()
+            self.assertEqual(
+                resolve_user_id({'sub': 'auth0|a'}, 'Bearer token'), user_id)
+            self.assertEqual(fetch.call_count, 1)
+            self.assertEqual(User.query.count(), 1)
+
+    def test_cached_subject_needs_no_lookup(self):
+        """Test a cached subject costs no /userinfo call and no query"""
+
+        identity_cache.set('auth0|a', 42)
+
+        with self.app.app_context(), mock.patch(
+                'identity.fetch_userinfo') as fetch, mock.patch(
+                'identity.User') as user:
+            self.assertEqual(
+                resolve_user_id({'sub': 'auth0|a'}, 'Bearer token'), 42)
+
+        fetch.assert_not_called()
+        user.query.filter.assert_not_called()
+
+    def test_token_without_subject_is_rejected(self):
+        """Test 401 for a token without a sub claim"""
+
+        with self.app.app_context():
+            with self.assertRaises(AuthError) as error:
+                resolve_user_id({}, 'Bearer token')
+
+        self.assertEqual(error.exception.status_code, 401)
+
+
+def load_revision(revision):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'migrations', 'versions', revision + '_.py')
+    spec = importlib.util.spec_from_file_location(revision, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class MigrationTestCase(unittest.TestCase):
+    """This class tests the index and constraint migration"""
+
+    def setUp(self):
+        self.revision = load_revision('9e6f2a8b1d30')
+
+    def test_postgresql_builds_indexes_concurrently(self):
+        """Test the indexes are built without blocking writes"""
+
+        output = io.StringIO()
+        context = MigrationContext.configure(
+            dialect_name='postgresql',
+            opts={'as_sql': True, 'output_buffer': output})
+        with Operations.context(context):
+            self.revision.upgrade()
+        sql = output.getvalue()
+
+        self.assertIn('CREATE INDEX CONCURRENTLY ix_product_user_id_id '
+                      'ON product (user_id, id)', sql)
+        self.assertIn('CREATE UNIQUE INDEX CONCURRENTLY ix_users_email', sql)
+        self.assertIn('ADD CONSTRAINT uq_users_email UNIQUE USING INDEX '
+                      'ix_users_email', sql)
+        # The concurrent builds run outside of the migration's transaction
+        self.assertLess(sql.index('COMMIT'), sql.index('CONCURRENTLY'))
+
+    def test_email_becomes_unique(self):
+        """Test the upgrade adds the constraint and the downgrade drops it"""
+
+        engine = sqlalchemy.create_engine('sqlite://')
+        with engine.connect() as connection:
+            for table in ('users (id INTEGER PRIMARY KEY, email VARCHAR)',
+                          'product (id INTEGER PRIMARY KEY, user_id INTEGER)',
+                          'sell_items (id INTEGER PRIMARY KEY, '
+                          'user_id INTEGER)'):
+                connection.execute('CREATE TABLE ' + table)
+
+            with Operations.context(MigrationContext.configure(connection)):
+                self.revision.upgrade()
+                inspector = sqlalchemy.inspect(connection)
+                self.assertEqual(
+                    [c['name'] for c in
+                     inspector.get_unique_constraints('users')],
+                    ['uq_users_email'])
+                self.assertIn('ix_product_user_id_id',
+                              [i['name'] for i in
+                               inspector.get_indexes('product')])
+
+                self.revision.downgrade()
+                inspector = sqlalchemy.inspect(connection)
+                self.assertEqual(inspector.get_unique_constraints('users'),
+                                 [])
+
+
+class ReadQueryTestCase(unittest.TestCase):
+    """This class tests the Core read path against the models' format()"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        setup_db(self.app, 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'warranty.db'), [])
+
+        with self.app.app_context():
+            user = User('A', 'a@example.com')
+            user.insert()
+            Product('Laptop', date(2020, 1, 1), date(2022, 1, 1),
+                    user.id).insert()
+            Product('Café table', None, date(2021, 6, 30), user.id).insert()
+            Items_for_Sale('Desk', 12, 'Oak desk', 'http://img/desk.png',
+                           user.id).insert()
+            Items_for_Sale('Lamp', None, None, None, user.id).insert()
+
+    def assertReadsLikeFormat(self, model, fields=None, sort_keys=()):
+        # Select the fields plus the sort keys, like select_fields does
+        columns = None
+        if fields is not None:
+            columns = list(fields) + [key for key in sort_keys
+                                      if key not in fields]
+
+        rows = read_query(model, columns).order_by(model.id).all()
+
+        self.assertEqual(
+            project_rows(rows, fields),
+            [row.format(fields) for row in
+             model.query.order_by(model.id).all()])
+
+    def test_rows_match_format(self):
+        """Test listing rows are the dicts format() returns"""
+
+        with self.app.app_context():
+            self.assertReadsLikeFormat(Product)
+            self.assertReadsLikeFormat(Items_for_Sale)
+
+    def test_sparse_rows_match_format(self):
+        """Test ?fields= rows match format(fields) without sort keys"""
+
+        with self.app.app_context():
+            self.assertReadsLikeFormat(Product, ['name', 'id'])
+            self.assertReadsLikeFormat(Product, ['name'], ('id',))
+            self.assertReadsLikeFormat(
+                Product, ['date_purchased'], ('id', 'warranty_end_date'))
+            self.assertReadsLikeFormat(Items_for_Sale, ['image_link'],
+                                       ('id',))
+
+
+class UnitOfWorkTestCase(unittest.TestCase):
+    """This class tests the one-transaction-per-request unit of work"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        setup_db(self.app, 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'warranty.db'), [])
+        self.committed = []
+
+    def test_changes_commit_once_at_the_end(self):
+        """Test staged changes and callbacks apply only on commit"""
+
+        with self.app.app_context():
+            begin_unit_of_work()
+            product = Product('Laptop', date(2020, 1, 1), date(2022, 1, 1),
+                              None)
+            product.insert()
+            on_commit(lambda: self.committed.append(product.id))
+
+            self.assertIsNotNone(product.id)
+            self.assertEqual(self.committed, [])
+
+            end_unit_of_work()
+            db.session.remove()
+
+            self.assertEqual(Product.query.count(), 1)
+            self.assertEqual(len(self.committed), 1)
+
+    def test_failed_request_rolls_back(self):
+        """Test nothing staged by a failed request is written"""
+
+        with self.app.app_context():
+            begin_unit_of_work()
+            Product('Laptop', date(2020, 1, 1), date(2022, 1, 1),
+                    None).insert()
+            on_commit(lambda: self.committed.append(True))
+
+            end_unit_of_work(commit=False)
+            db.session.remove()
+
+            self.assertEqual(Product.query.count(), 0)
+            self.assertEqual(self.committed, [])
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":